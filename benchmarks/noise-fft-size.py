@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import timeit
+import numpy
+from enviroplus.noise import Noise
+
+print("""noise-fft-size.py - Benchmark Noise analysis cost against FFT size.
+
+Times get_noise_profile and a 30-band get_amplitudes_at_frequency_ranges
+call on a pre-recorded capture, so only the analysis is measured.
+
+The fft_size=sample_rate row is the cost of the original fixed FFT.
+A single FFT must hold the whole capture, so sizes below it use the
+"welch" method, which averages segments covering all of the audio.
+
+""")
+
+SAMPLE_RATE = 16000
+DURATION = 0.5
+REPEAT = 200
+
+RANGES = [(f, f + 200) for f in range(100, 6100, 200)]
+
+
+class RecordedNoise(Noise):
+    def __init__(self, recording, **kwargs):
+        Noise.__init__(self, **kwargs)
+        self.recording = recording
+
+    def _record(self):
+        return self.recording
+
+
+recording = numpy.random.uniform(-1.0, 1.0, (int(SAMPLE_RATE * DURATION), 1))
+
+print("{:>10} {:>8} {:>12} {:>16} {:>16}".format("fft_size", "method", "bin (Hz)", "profile (us)", "30 bands (us)"))
+
+for fft_size, method in ((SAMPLE_RATE, 'fft'), (None, 'fft'), (4096, 'welch'), (2048, 'welch'), (1024, 'welch'), (512, 'welch')):
+    noise = RecordedNoise(recording, sample_rate=SAMPLE_RATE, duration=DURATION, fft_size=fft_size, method=method)
+
+    profile = min(timeit.repeat(noise.get_noise_profile, number=REPEAT, repeat=3)) / REPEAT
+    bands = min(timeit.repeat(lambda: noise.get_amplitudes_at_frequency_ranges(RANGES), number=REPEAT, repeat=3)) / REPEAT
+
+    print("{:>10} {:>8} {:>12.3f} {:>16.1f} {:>16.1f}".format(
+        noise.fft_size,
+        method,
+        SAMPLE_RATE / float(noise.fft_size),
+        profile * 1e6,
+        bands * 1e6))
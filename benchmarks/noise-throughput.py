@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import time
+import argparse
+import numpy
+from enviroplus.noise import Noise, ArraySource, WavSource
+
+print("""noise-throughput.py - Measure Noise analysis throughput on recorded audio.
+
+Pushes recorded (or synthetic) audio through every analysis method and
+reports how many times faster than real time each one runs.
+
+""")
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--hours', type=float, default=1.0, help='hours of audio to analyse per method')
+parser.add_argument('--wav', help='WAV file to analyse (looped), defaults to synthetic noise')
+parser.add_argument('--sample-rate', type=int, default=16000, help='sample rate of synthetic audio')
+parser.add_argument('--duration', type=float, default=0.5, help='capture duration per call')
+parser.add_argument('--method', default='fft', choices=('fft', 'welch'))
+parser.add_argument('--dtype', default='float64', choices=('float32', 'float64'))
+args = parser.parse_args()
+
+RANGES = [(f, f + 200) for f in range(100, 6100, 200)]
+
+ANALYSES = [
+    ('get_noise_profile', lambda noise: noise.get_noise_profile()),
+    ('get_amplitudes_at_frequency_ranges x30', lambda noise: noise.get_amplitudes_at_frequency_ranges(RANGES)),
+    ('get_sound_levels', lambda noise: noise.get_sound_levels()),
+    ('get_octave_band_levels 1/3', lambda noise: noise.get_octave_band_levels(fraction=3)),
+    ('get_psd', lambda noise: noise.get_psd())
+]
+
+
+def make_source():
+    if args.wav:
+        return WavSource(args.wav, loop=True)
+
+    t = numpy.arange(args.sample_rate * 10) / float(args.sample_rate)
+    audio = numpy.random.normal(0.0, 0.05, len(t))
+    audio += 0.1 * numpy.sin(2 * numpy.pi * 440 * t)
+    return ArraySource(audio, args.sample_rate, loop=True)
+
+
+sample_rate = make_source().sample_rate
+calls = int(args.hours * 3600 / args.duration)
+
+print("{} hours of audio at {}Hz, {} calls per method\n".format(args.hours, sample_rate, calls))
+print("{:<40} {:>12} {:>14}".format("analysis", "per call (us)", "x real time"))
+
+for name, analysis in ANALYSES:
+    noise = Noise(
+        sample_rate=sample_rate,
+        duration=args.duration,
+        method=args.method,
+        dtype=args.dtype,
+        source=make_source())
+
+    t_start = time.time()
+    for _ in range(calls):
+        analysis(noise)
+    elapsed = time.time() - t_start
+
+    print("{:<40} {:>12.1f} {:>14.0f}".format(name, elapsed / calls * 1e6, calls * args.duration / elapsed))
@@ -0,0 +1,41 @@
+import asyncio
+import ST7735
+import numpy
+from PIL import Image
+from enviroplus.noise import Noise
+
+print("""noise-spectrogram.py - Display a scrolling spectrogram.
+
+This example streams audio from the microphone and keeps a rolling, uint8 quantised spectrogram in memory, drawing it to the Enviro+ display with low frequencies at the bottom.
+
+Press Ctrl+C to exit!
+
+""")
+
+disp = ST7735.ST7735(
+    port=0,
+    cs=ST7735.BG_SPI_CS_FRONT,
+    dc=9,
+    backlight=12,
+    rotation=90)
+
+disp.begin()
+
+noise = Noise(duration=0.1, fft_size=1024, method='welch', stream=True)
+history = noise.enable_history(disp.width, quantise=True, db_min=-110.0, db_max=-30.0)
+
+# One display row per FFT bin from 0Hz up to the display height
+rows = numpy.arange(disp.height)[::-1]
+
+
+async def main():
+    while True:
+        # Waits for the next window of new audio, adding one column to the history
+        await noise.get_noise_profile_async()
+        frames = history.latest()[:, rows]
+        img = Image.new('L', (disp.width, disp.height))
+        img.paste(Image.fromarray(numpy.ascontiguousarray(frames.T)), (disp.width - len(frames), 0))
+        disp.display(img.convert('RGB'))
+
+
+asyncio.get_event_loop().run_until_complete(main())
@@ -1,28 +1,98 @@
 """Read the MICS6814 via an ads1015 ADC"""
 
+import os
 import time
+import json
+import math
 import atexit
+import threading
+import concurrent.futures
+import numpy
 import ads1015
 import RPi.GPIO as GPIO
 
 MICS6814_HEATER_PIN = 24
 MICS6814_GAIN = 6.144
+MICS6814_I2C_ADDR = 0x49
+
+# Each sensing element is read across a load resistor to the supply rail
+MICS6814_LOAD_RESISTANCE = 56000
+MICS6814_SUPPLY_VOLTAGE = 3.3
+
+# ADC input for each channel, "adc" is the spare analog input
+MICS6814_CHANNELS = {
+    'oxidising': 'in0/gnd',
+    'reducing': 'in1/gnd',
+    'nh3': 'in2/gnd',
+    'adc': 'ref/gnd'
+}
+
+# Column order of Mics6814History values
+MICS6814_HISTORY_CHANNELS = ('oxidising', 'reducing', 'nh3', 'adc')
+
+# Rs/R0 to ppm points read from the MiCS-6814 datasheet sensitivity curves,
+# as the channel that responds to each gas and (ratio, ppm) pairs across the curve's range
+MICS6814_PPM_CURVES = {
+    'co': ('reducing', ((3.5, 1), (1.38, 3), (0.497, 10), (0.196, 30), (0.0705, 100), (0.0278, 300), (0.01, 1000))),
+    'no2': ('oxidising', ((0.345, 0.05), (0.687, 0.1), (2.05, 0.3), (6.76, 1), (20.1, 3), (66.6, 10))),
+    'nh3': ('nh3', ((0.794, 1), (0.411, 3), (0.2, 10), (0.104, 30), (0.0504, 100), (0.0261, 300), (0.0192, 500))),
+    'hydrogen': ('reducing', ((0.84, 1), (0.456, 3), (0.234, 10), (0.127, 30), (0.065, 100), (0.0353, 300), (0.0181, 1000))),
+    'ethanol': ('reducing', ((0.31, 10), (0.153, 30), (0.0703, 100), (0.0346, 300), (0.0249, 500)))
+}
+
+# Clean air gives the lowest resistance for the oxidising element and the highest for the others
+MICS6814_BASELINE_PERCENTILES = {
+    'oxidising': 10,
+    'reducing': 90,
+    'nh3': 90
+}
+
+# Resistance range in Ohms and number of log-spaced bins of the percentile baseline histograms
+MICS6814_BASELINE_RANGE = (1e2, 1e8)
+MICS6814_BASELINE_BINS = 240
+
+# Default ADC data rate in samples per second for each supported chip
+MICS6814_SAMPLE_RATES = {
+    'ADS1015': 1600,
+    'ADS1115': 128
+}
+
+# Allowance for the ADC's internal clock, whose data rate can be 10% slow
+MICS6814_CLOCK_MARGIN = 1.1
+
+# Seconds after the heater is switched on before readings are meaningful
+MICS6814_WARMUP_TIME = 600.0
+
+# Default seconds between conversions of the slowly changing spare ADC channel
+MICS6814_ADC_INTERVAL = 10.0
+
+# Fraction of samples discarded from each end by the "trimmed" reducer
+TRIM_FRACTION = 0.1
 
 ads1015.I2C_ADDRESS_DEFAULT = ads1015.I2C_ADDRESS_ALTERNATE
-_is_setup = False
-_is_available = False
-_adc_enabled = False
-_adc_gain = 6.148
+
+_default = None
+
+# Curves as log ratio (increasing) and log ppm arrays for numpy.interp
+_ppm_curves = {}
+for _gas, (_channel, _points) in MICS6814_PPM_CURVES.items():
+    _points = numpy.log(sorted(_points))
+    _ppm_curves[_gas] = (_channel, _points[:, 0], _points[:, 1])
 
 
 class Mics6814Reading(object):
-    __slots__ = 'oxidising', 'reducing', 'nh3', 'adc'
+    __slots__ = 'oxidising', 'reducing', 'nh3', 'adc', 'timestamp', 'compensated', 'status'
 
-    def __init__(self, ox, red, nh3, adc=None):
+    def __init__(self, ox, red, nh3, adc=None, timestamp=None, compensated=None, status=None):
         self.oxidising = ox
         self.reducing = red
         self.nh3 = nh3
         self.adc = adc
+        self.timestamp = timestamp
+        # Temperature and humidity compensated Mics6814Reading, if compensation is set up
+        self.compensated = compensated
+        # "warming" while the heater warms up, "valid" after and "off" once cleanup switches it off
+        self.status = status
 
     def __repr__(self):
         fmt = """Oxidising: {ox:05.02f} Ohms
@@ -41,93 +111,1088 @@ ADC: {adc:05.02f} Volts
     __str__ = __repr__
 
 
+class Mics6814History(object):
+    def __init__(self, size, dtype='float64'):
+        """Fixed-size columnar history of gas readings.
+
+        Timestamps and channel values live in preallocated numpy arrays rather than one
+        Mics6814Reading per sample. Each sample is written twice into buffers of 2 x size
+        rows so the most recent samples are always contiguous and returned as views.
+        Readings are only built when indexing or iterating. A missing spare ADC value is
+        stored as NaN.
+
+        :param size: Number of readings to keep
+        :param dtype: Storage type of channel values, float32 halves the memory used
+
+        """
+        self.size = size
+        self.count = 0
+
+        self._timestamps = numpy.zeros(size * 2, dtype='float64')
+        self._values = numpy.zeros((size * 2, len(MICS6814_HISTORY_CHANNELS)), dtype=dtype)
+        self._position = size - 1
+
+    @classmethod
+    def from_readings(cls, readings, size=None, dtype='float64'):
+        """Build a history from a sequence of Mics6814Reading.
+
+        :param readings: Readings, oldest first
+        :param size: Number of readings to keep, defaults to the number of readings
+        :param dtype: Storage type of channel values
+
+        """
+        readings = list(readings)
+        history = cls(len(readings) if size is None else size, dtype)
+        for reading in readings:
+            history.append(reading)
+        return history
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        """Return one Mics6814Reading, or a new history holding a copy of a slice."""
+        if isinstance(index, slice):
+            timestamps = self.timestamps[index]
+            history = Mics6814History(max(len(timestamps), 1), self._values.dtype)
+            history.extend(timestamps, self.values[index])
+            return history
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("History index out of range")
+
+        row = self._position + self.size + 1 - length + index
+        return self._reading(self._timestamps[row], self._values[row])
+
+    @property
+    def timestamps(self):
+        """Read-only view of the timestamps, oldest first."""
+        return self._latest(self._timestamps)
+
+    @property
+    def values(self):
+        """Read-only (N, 4) view of the channel values, oldest first, columns as MICS6814_HISTORY_CHANNELS."""
+        return self._latest(self._values)
+
+    def column(self, channel):
+        """Return a read-only view of one channel's values, oldest first.
+
+        :param channel: One of "oxidising", "reducing", "nh3" or "adc"
+
+        """
+        return self.values[:, MICS6814_HISTORY_CHANNELS.index(channel)]
+
+    def append(self, reading):
+        """Add a Mics6814Reading, replacing the oldest once the history is full."""
+        timestamp = time.time() if reading.timestamp is None else reading.timestamp
+        self.append_values(timestamp, reading.oxidising, reading.reducing, reading.nh3, reading.adc)
+
+    def append_values(self, timestamp, oxidising, reducing, nh3, adc=None):
+        """Add one sample from its values, replacing the oldest once the history is full."""
+        position = (self._position + 1) % self.size
+        row = self._values[position]
+        row[0] = oxidising
+        row[1] = reducing
+        row[2] = nh3
+        row[3] = numpy.nan if adc is None else adc
+        self._values[position + self.size] = row
+        self._timestamps[position] = self._timestamps[position + self.size] = timestamp
+        self._position = position
+        self.count += 1
+
+    def extend(self, timestamps, values):
+        """Add many samples at once.
+
+        :param timestamps: Array of N timestamps, oldest first
+        :param values: (N, 3) or (N, 4) array of channel values, columns as MICS6814_HISTORY_CHANNELS
+
+        """
+        timestamps = numpy.asarray(timestamps)[-self.size:]
+        values = numpy.asarray(values)[-self.size:]
+        count = len(timestamps)
+        if count == 0:
+            return
+
+        positions = (self._position + 1 + numpy.arange(count)) % self.size
+        columns = values.shape[1]
+        for offset in (0, self.size):
+            self._timestamps[positions + offset] = timestamps
+            self._values[positions + offset, :columns] = values
+            if columns < len(MICS6814_HISTORY_CHANNELS):
+                self._values[positions + offset, columns:] = numpy.nan
+
+        self._position = positions[-1]
+        self.count += count
+
+    def window(self, start=None, end=None):
+        """Return a new history holding the samples with start <= timestamp < end."""
+        timestamps = self.timestamps
+        first = 0 if start is None else numpy.searchsorted(timestamps, start, side='left')
+        last = len(timestamps) if end is None else numpy.searchsorted(timestamps, end, side='left')
+        return self[first:last]
+
+    def mean(self):
+        """Return a Mics6814Reading of the mean of each channel."""
+        return self._stat(numpy.mean, numpy.nanmean)
+
+    def min(self):
+        """Return a Mics6814Reading of the minimum of each channel."""
+        return self._stat(numpy.min, numpy.nanmin)
+
+    def max(self):
+        """Return a Mics6814Reading of the maximum of each channel."""
+        return self._stat(numpy.max, numpy.nanmax)
+
+    def std(self):
+        """Return a Mics6814Reading of the standard deviation of each channel."""
+        return self._stat(numpy.std, numpy.nanstd)
+
+    def _latest(self, storage):
+        end = self._position + self.size + 1
+        view = storage[end - len(self):end]
+        view.flags.writeable = False
+        return view
+
+    def _stat(self, function, nan_function):
+        if len(self) == 0:
+            raise ValueError("History is empty")
+        values = self.values
+        gas = function(values[:, :3], axis=0)
+        adc = values[:, 3]
+        adc = float(nan_function(adc)) if not numpy.isnan(adc).all() else None
+        return Mics6814Reading(float(gas[0]), float(gas[1]), float(gas[2]), adc)
+
+    def _reading(self, timestamp, values):
+        adc = None if numpy.isnan(values[3]) else float(values[3])
+        return Mics6814Reading(float(values[0]), float(values[1]), float(values[2]), adc, timestamp=float(timestamp))
+
+
+class Mics6814Baseline(object):
+    def __init__(self, method='ewma', time_constant=86400.0, percentiles=None, path=None, save_interval=600.0):
+        """Online clean-air resistance (R0) tracker for the three gas channels.
+
+        Uses constant memory: "ewma" keeps a time-weighted moving average per channel,
+        "percentile" keeps an exponentially decaying log-spaced histogram per channel and
+        reports a percentile of it, which follows clean air better when pollution is frequent.
+
+        State is saved as JSON to path, if given, at most every save_interval seconds and
+        loaded from it on creation, so a restart doesn't need a fresh burn-in.
+
+        :param method: "ewma" or "percentile"
+        :param time_constant: Seconds over which old samples lose weight by a factor of e
+        :param percentiles: Optional dict of percentile per channel, defaults to MICS6814_BASELINE_PERCENTILES
+        :param path: Optional JSON file to persist the baseline to
+        :param save_interval: Minimum seconds between automatic saves
+
+        """
+        if method not in ('ewma', 'percentile'):
+            raise ValueError("Method must be one of 'ewma' or 'percentile'")
+
+        self.method = method
+        self.time_constant = time_constant
+        self.percentiles = dict(MICS6814_BASELINE_PERCENTILES if percentiles is None else percentiles)
+        self.path = path
+        self.save_interval = save_interval
+
+        self.samples = 0
+        self.last_update = None
+        self._last_save = None
+
+        self._edges = numpy.linspace(
+            numpy.log(MICS6814_BASELINE_RANGE[0]),
+            numpy.log(MICS6814_BASELINE_RANGE[1]),
+            MICS6814_BASELINE_BINS + 1)
+        self._centres = numpy.exp((self._edges[:-1] + self._edges[1:]) / 2)
+        self._averages = numpy.zeros(3)
+        self._histograms = numpy.zeros((3, MICS6814_BASELINE_BINS))
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def update(self, reading):
+        """Add a Mics6814Reading to the baseline, using its timestamp if it has one."""
+        timestamp = time.time() if reading.timestamp is None else reading.timestamp
+        values = numpy.array((reading.oxidising, reading.reducing, reading.nh3), dtype='float64')
+
+        if self.last_update is None:
+            weight = 1.0
+        else:
+            weight = 1.0 - numpy.exp(-max(timestamp - self.last_update, 0) / self.time_constant)
+
+        if self.method == 'ewma':
+            self._averages += (values - self._averages) * weight
+        else:
+            self._histograms *= 1.0 - weight
+            bins = numpy.searchsorted(self._edges, numpy.log(numpy.maximum(values, 1e-9))) - 1
+            bins = numpy.clip(bins, 0, MICS6814_BASELINE_BINS - 1)
+            self._histograms[(0, 1, 2), bins] += 1
+
+        self.samples += 1
+        self.last_update = timestamp
+
+        if self.path is not None and (self._last_save is None or timestamp - self._last_save >= self.save_interval):
+            self.save()
+            self._last_save = timestamp
+
+    def baseline(self):
+        """Return a Mics6814Reading of the R0 estimate for each channel, or None before the first update."""
+        if self.samples == 0:
+            return None
+
+        if self.method == 'ewma':
+            r0 = self._averages
+        else:
+            r0 = []
+            for index, channel in enumerate(('oxidising', 'reducing', 'nh3')):
+                cumulative = numpy.cumsum(self._histograms[index])
+                target = cumulative[-1] * self.percentiles[channel] / 100.0
+                r0.append(self._centres[min(numpy.searchsorted(cumulative, target), MICS6814_BASELINE_BINS - 1)])
+
+        return Mics6814Reading(float(r0[0]), float(r0[1]), float(r0[2]), timestamp=self.last_update)
+
+    def ratios(self, reading):
+        """Return a Mics6814Reading of the Rs/R0 ratio of each channel, or None before the first update."""
+        r0 = self.baseline()
+        if r0 is None:
+            return None
+        return Mics6814Reading(
+            reading.oxidising / r0.oxidising,
+            reading.reducing / r0.reducing,
+            reading.nh3 / r0.nh3,
+            timestamp=reading.timestamp)
+
+    def ppm(self, reading, gases=None):
+        """Return a dict of estimated concentrations in ppm for a Mics6814Reading.
+
+        Estimates outside the range of a datasheet curve are NaN.
+
+        :param gases: Optional list of gases, defaults to all of MICS6814_PPM_CURVES
+
+        """
+        ratios = self.ratios(reading)
+        if ratios is None:
+            return None
+        return {gas: float(ratio_to_ppm(gas, getattr(ratios, MICS6814_PPM_CURVES[gas][0])))
+                for gas in (MICS6814_PPM_CURVES if gases is None else gases)}
+
+    def save(self, path=None):
+        """Write the baseline state as JSON, to path or the path given on creation."""
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("No path to save the baseline to")
+        state = {
+            'method': self.method,
+            'time_constant': self.time_constant,
+            'samples': self.samples,
+            'last_update': self.last_update,
+            'averages': self._averages.tolist(),
+            'histograms': self._histograms.tolist()
+        }
+        # Replace the file in one step so a crash never leaves a truncated baseline
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp, path)
+
+    def load(self, path=None):
+        """Restore the baseline state saved by save."""
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("No path to load the baseline from")
+        with open(path) as f:
+            state = json.load(f)
+
+        if state['method'] != self.method:
+            raise ValueError("Baseline in {} uses the {} method".format(path, state['method']))
+
+        averages = numpy.array(state['averages'], dtype='float64')
+        histograms = numpy.array(state['histograms'], dtype='float64')
+        if averages.shape != self._averages.shape or histograms.shape != self._histograms.shape:
+            raise ValueError("Baseline in {} does not match {} histogram bins".format(path, MICS6814_BASELINE_BINS))
+
+        self.samples = state['samples']
+        self.last_update = state['last_update']
+        self._averages = averages
+        self._histograms = histograms
+
+
+class Mics6814Compensation(object):
+    def __init__(self, reference_temperature=20.0, reference_humidity=50.0, coefficients=None):
+        """Temperature and humidity compensation for the gas resistances.
+
+        Models each channel as log R = a + b (T - Tref) + c (H - Href) and corrects
+        resistances to the reference conditions by dividing out exp(b dT + c dH).
+        Fitting is a single least-squares solve over stored history, applying it is
+        a handful of multiplications per sample.
+
+        :param reference_temperature: Temperature in degrees C that readings are corrected to
+        :param reference_humidity: Relative humidity in % that readings are corrected to
+        :param coefficients: Optional (b, c) pairs for oxidising, reducing and NH3 from an earlier fit
+
+        """
+        self.reference_temperature = reference_temperature
+        self.reference_humidity = reference_humidity
+        self.coefficients = None
+        if coefficients is not None:
+            self.coefficients = tuple((float(b), float(c)) for b, c in coefficients)
+
+    def fit(self, temperatures, humidities, resistances):
+        """Fit the model to synchronised samples, ignoring any with missing values.
+
+        :param temperatures: Array of N temperatures in degrees C
+        :param humidities: Array of N relative humidities in %
+        :param resistances: (N, 3) array of oxidising, reducing and NH3 resistances in Ohms
+
+        """
+        temperatures = numpy.asarray(temperatures, dtype='float64')
+        humidities = numpy.asarray(humidities, dtype='float64')
+        resistances = numpy.asarray(resistances, dtype='float64')[:, :3]
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            log_resistances = numpy.log(resistances)
+
+        valid = numpy.isfinite(temperatures) & numpy.isfinite(humidities) & numpy.isfinite(log_resistances).all(axis=1)
+        if valid.sum() < 3:
+            raise ValueError("At least 3 complete samples are needed to fit compensation")
+
+        design = numpy.column_stack((
+            numpy.ones(valid.sum()),
+            temperatures[valid] - self.reference_temperature,
+            humidities[valid] - self.reference_humidity))
+
+        # One solve fits all three channels, rows of the solution are a, b and c
+        solution = numpy.linalg.lstsq(design, log_resistances[valid], rcond=None)[0]
+        self.coefficients = tuple((float(solution[1, i]), float(solution[2, i])) for i in range(3))
+        return self.coefficients
+
+    def fit_history(self, history, timestamps, temperatures, humidities):
+        """Fit the model to a Mics6814History, interpolating environment samples onto its timestamps.
+
+        :param history: Mics6814History of gas readings
+        :param timestamps: Array of timestamps of the environment samples, in increasing order
+        :param temperatures: Array of temperatures in degrees C at those timestamps
+        :param humidities: Array of relative humidities in % at those timestamps
+
+        """
+        gas_timestamps = history.timestamps
+        return self.fit(
+            numpy.interp(gas_timestamps, timestamps, temperatures, left=numpy.nan, right=numpy.nan),
+            numpy.interp(gas_timestamps, timestamps, humidities, left=numpy.nan, right=numpy.nan),
+            history.values)
+
+    def apply(self, reading, temperature, humidity):
+        """Return a compensated copy of a Mics6814Reading.
+
+        :param reading: Raw Mics6814Reading
+        :param temperature: Temperature in degrees C when the reading was taken
+        :param humidity: Relative humidity in % when the reading was taken
+
+        """
+        if self.coefficients is None:
+            raise RuntimeError("Compensation has not been fitted.")
+        dt = temperature - self.reference_temperature
+        dh = humidity - self.reference_humidity
+        (ox_b, ox_c), (red_b, red_c), (nh3_b, nh3_c) = self.coefficients
+        return Mics6814Reading(
+            reading.oxidising * math.exp(-(ox_b * dt + ox_c * dh)),
+            reading.reducing * math.exp(-(red_b * dt + red_c * dh)),
+            reading.nh3 * math.exp(-(nh3_b * dt + nh3_c * dh)),
+            reading.adc,
+            timestamp=reading.timestamp)
+
+    def compensate(self, temperatures, humidities, resistances):
+        """Return compensated copies of arrays of resistances.
+
+        :param temperatures: Array of N temperatures in degrees C
+        :param humidities: Array of N relative humidities in %
+        :param resistances: (N, 3) array of oxidising, reducing and NH3 resistances in Ohms
+
+        """
+        if self.coefficients is None:
+            raise RuntimeError("Compensation has not been fitted.")
+        coefficients = numpy.array(self.coefficients)
+        dt = numpy.asarray(temperatures, dtype='float64')[:, None] - self.reference_temperature
+        dh = numpy.asarray(humidities, dtype='float64')[:, None] - self.reference_humidity
+        return numpy.asarray(resistances, dtype='float64')[:, :3] * numpy.exp(-(coefficients[:, 0] * dt + coefficients[:, 1] * dh))
+
+
+class MICS6814(object):
+    def __init__(self, i2c_dev=None, i2c_addr=MICS6814_I2C_ADDR, heater_pin=MICS6814_HEATER_PIN, mode='single', sample_rate=None, warmup=MICS6814_WARMUP_TIME):
+        """MICS6814 gas sensor read via an ads1015/ads1115 ADC.
+
+        :param i2c_dev: Optional SMBus instance for the ADC's I2C bus
+        :param i2c_addr: I2C address of the ADC
+        :param heater_pin: BCM pin that switches the sensor heater, or None if it is not switchable
+        :param mode: ADC conversion mode, "single" or "continuous", see set_mode
+        :param sample_rate: ADC data rate in samples per second, defaults to 1600 (ADS1015) or 128 (ADS1115)
+        :param warmup: Seconds after the heater is switched on before readings are valid
+
+        """
+        if mode not in ('single', 'continuous'):
+            raise ValueError("Mode must be one of 'single' or 'continuous'")
+
+        self.i2c_dev = i2c_dev
+        self.i2c_addr = i2c_addr
+        self.heater_pin = heater_pin
+        self.mode = mode
+        self.warmup = warmup
+
+        self.adc = None
+        self.adc_type = None
+        self.sample_rate = sample_rate
+
+        self._is_setup = False
+        self._is_available = False
+        self._adc_enabled = False
+        self._adc_gain = 6.148
+        self._adc_interval = MICS6814_ADC_INTERVAL
+        self._adc_value = None
+        self._adc_time = None
+
+        # Serialises ADC access between the sampler thread and direct reads
+        self._adc_lock = threading.Lock()
+
+        # Input selected in continuous mode and when its last conversion was fetched
+        self._mux = None
+        self._last_fetch = 0
+
+        self._compensation = None
+        self._environment = None
+
+        self._lock = threading.Lock()
+        self._latest = None
+        self._max_age = None
+        self._sampler = None
+        self._stop_sampler = threading.Event()
+        self.history = Mics6814History(1)
+
+        self._heater_on = None
+        self._ready = False
+        self._ready_callbacks = []
+        self._ready_timer = None
+        self._heater_off = False
+        self._atexit_registered = False
+
+    def setup(self):
+        """Set up the ADC and switch the heater on, restarting the warm-up after cleanup."""
+        if self._is_setup:
+            return
+        self._is_setup = True
+        self._heater_off = False
+        self._mux = None
+
+        try:
+            self.adc = ads1015.ADS1015(i2c_addr=self.i2c_addr, i2c_dev=self.i2c_dev)
+            self.adc_type = self.adc.detect_chip_type()
+            self._is_available = True
+        except IOError:
+            self._is_available = False
+            return
+
+        if self.sample_rate is None:
+            self.sample_rate = MICS6814_SAMPLE_RATES[self.adc_type]
+        self.adc.set_mode(self.mode)
+        self.adc.set_programmable_gain(MICS6814_GAIN)
+        self.adc.set_sample_rate(self.sample_rate)
+
+        if self.heater_pin is not None:
+            GPIO.setwarnings(False)
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(self.heater_pin, GPIO.OUT)
+            GPIO.output(self.heater_pin, 1)
+            if not self._atexit_registered:
+                atexit.register(self.cleanup)
+                self._atexit_registered = True
+
+        # Without a heater pin the heater is assumed to be powered from now on
+        self._heater_on = time.time()
+        if self.warmup > 0:
+            self._ready_timer = threading.Timer(self.warmup, self._set_ready)
+            self._ready_timer.daemon = True
+            self._ready_timer.start()
+        else:
+            self._set_ready()
+
+    def available(self):
+        self._setup_if_needed()
+        return self._is_available
+
+    def set_mode(self, mode, sample_rate=None):
+        """Set the ADC conversion mode.
+
+        In "single" mode every read starts a conversion and polls for the result.
+        In "continuous" mode the ADC converts all the time at its data rate. Repeated
+        reads of the same channel only wait for the next conversion, so one channel
+        can be sampled at close to the full data rate.
+
+        Continuous mode does not speed up reads across several channels, eg read_all.
+        The ADC has no conversion-ready flag to poll in this mode, so after switching
+        input a read waits two conversion periods, because the conversion in progress
+        may still be on the old input. Single mode needs only one conversion plus polling.
+
+        :param mode: "single" or "continuous"
+        :param sample_rate: Optional ADC data rate in samples per second, eg 3300 (ADS1015) or 860 (ADS1115) for the highest throughput
+
+        """
+        if mode not in ('single', 'continuous'):
+            raise ValueError("Mode must be one of 'single' or 'continuous'")
+        self.mode = mode
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        self._mux = None
+        if self._is_available:
+            self.adc.set_mode(self.mode)
+            self.adc.set_sample_rate(self.sample_rate)
+
+    def enable_adc(self, value=True, interval=None):
+        """Enable reading from the additional ADC pin.
+
+        When the spare channel's gain differs from the gas channels, read_all converts it
+        at most once per interval and returns the last value in between, so gas reads
+        don't pay for a gain switch every time. read_adc always converts.
+
+        :param value: True to include the spare channel in readings
+        :param interval: Optional seconds between spare channel conversions in read_all, 0 to convert on every read
+
+        """
+        self._adc_enabled = value
+        if interval is not None:
+            self._adc_interval = interval
+        self._adc_value = None
+
+    def set_adc_gain(self, value):
+        """Set gain value for the additional ADC pin."""
+        self._adc_gain = value
+        self._adc_value = None
+
+    def cleanup(self):
+        """Stop the sampler and switch the heater off.
+
+        Reads still work afterwards but are tagged "off", call setup to switch the heater back on.
+
+        """
+        self.stop_sampler()
+        if self.heater_pin is not None:
+            GPIO.output(self.heater_pin, 0)
+            if self._ready_timer is not None:
+                self._ready_timer.cancel()
+            with self._lock:
+                self._heater_on = None
+                self._ready = False
+            self._is_setup = False
+            self._heater_off = True
+
+    def heater_state(self):
+        """Return "off" before setup or after cleanup, "warming" during warm-up and "valid" after.
+
+        Readings are tagged with the same "warming" or "valid" status.
+
+        """
+        with self._lock:
+            if self._heater_on is None:
+                return 'off'
+            return 'valid' if self._ready else 'warming'
+
+    def warmup_remaining(self):
+        """Return seconds until the heater has warmed up, 0 once valid or None if it is off."""
+        with self._lock:
+            if self._heater_on is None:
+                return None
+            if self._ready:
+                return 0
+            return max(0, self.warmup - (time.time() - self._heater_on))
+
+    def on_ready(self, callback):
+        """Call callback(sensor) once the heater has warmed up.
+
+        Sets up the sensor if needed. The callback runs on the warm-up timer's thread,
+        or immediately if the sensor has already warmed up.
+
+        Raises RuntimeError if the sensor is not connected or its heater has been switched off by cleanup.
+
+        """
+        self._setup_if_needed()
+
+        if not self._is_available:
+            raise RuntimeError("Gas sensor not connected.")
+
+        with self._lock:
+            if self._heater_on is None:
+                raise RuntimeError("Gas sensor heater is off.")
+            if not self._ready:
+                self._ready_callbacks.append(callback)
+                return
+        callback(self)
+
+    def ready_future(self):
+        """Return a concurrent.futures.Future resolved with the sensor once the heater has warmed up.
+
+        Wrap it with asyncio.wrap_future to await it from a coroutine. If the sensor
+        is not connected the future holds the RuntimeError from on_ready instead.
+
+        """
+        future = concurrent.futures.Future()
+        try:
+            self.on_ready(future.set_result)
+        except RuntimeError as e:
+            future.set_exception(e)
+        return future
+
+    def set_compensation(self, compensation, environment):
+        """Attach temperature and humidity compensated values to every reading.
+
+        Readings from read_all and the sampler get a compensated Mics6814Reading
+        alongside the raw values. If environment raises, that reading is returned
+        with compensated set to None.
+
+        :param compensation: Fitted Mics6814Compensation, or None to stop compensating
+        :param environment: Function returning (temperature in degrees C, relative humidity in %), eg from a BME280
+
+        """
+        if compensation is not None and compensation.coefficients is None:
+            raise ValueError("Compensation has not been fitted.")
+        self._compensation = compensation
+        self._environment = environment
+
+    def start_sampler(self, interval=1.0, history=60, max_age=None):
+        """Read all channels on a background thread and serve reads from the latest result.
+
+        While the sampler runs and its latest reading is fresh, read_all and the
+        single channel reads return cached values instead of touching the ADC.
+
+        :param interval: Seconds between readings
+        :param history: Number of recent readings kept in the sampler's Mics6814History
+        :param max_age: Seconds after which a cached reading is stale, defaults to twice the interval
+
+        """
+        self._setup_if_needed()
+
+        if not self._is_available:
+            raise RuntimeError("Gas sensor not connected.")
+
+        self.stop_sampler()
+
+        with self._lock:
+            self._latest = None
+            self._max_age = interval * 2 if max_age is None else max_age
+            self.history = Mics6814History(history)
+
+        self._stop_sampler.clear()
+        self._sampler = threading.Thread(target=self._run_sampler, args=(interval,))
+        self._sampler.daemon = True
+        self._sampler.start()
+
+    def stop_sampler(self):
+        """Stop the background sampler, reads go back to the ADC."""
+        if self._sampler is None:
+            return
+        self._stop_sampler.set()
+        self._sampler.join()
+        self._sampler = None
+        with self._lock:
+            self._latest = None
+
+    def get_latest(self):
+        """Return the sampler's latest reading, or None if there is none yet."""
+        with self._lock:
+            return self._latest
+
+    def get_history(self):
+        """Return a Mics6814History copy of the sampler's recent readings, oldest first."""
+        with self._lock:
+            return self.history[:]
+
+    def read_all(self, samples=1, reducer='median'):
+        """Return gas resistence for oxidising, reducing and NH3
+
+        :param samples: Number of conversions per channel, taken in a burst using the ADC's continuous mode and reduced to one value
+        :param reducer: How burst samples are combined, one of "median", "mean" or "trimmed" (mean without the highest and lowest 10%)
+
+        """
+        channels = ['oxidising', 'reducing', 'nh3']
+        if self._adc_enabled:
+            channels.append('adc')
+        self._check_read(channels, samples, reducer)
+
+        if samples == 1:
+            reading = self._cached()
+            if reading is not None and (reading.adc is not None) == self._adc_enabled:
+                return reading
+
+        timestamp = time.time()
+        values = self._convert(channels, samples, reducer, cache_adc=True)
+        return self._reading(values, timestamp)
+
+    def read_channels(self, channels, samples=1, reducer='median'):
+        """Return values for a subset of channels, converting only the ADC inputs requested.
+
+        :param channels: List of channel names, any of "oxidising", "reducing", "nh3" (resistances in Ohms) and "adc" (spare channel in Volts)
+        :param samples: Number of conversions per channel, see read_all
+        :param reducer: How burst samples are combined, see read_all
+
+        """
+        self._check_read(channels, samples, reducer)
+
+        if samples == 1:
+            reading = self._cached()
+            if reading is not None and ('adc' not in channels or reading.adc is not None):
+                return [getattr(reading, channel) for channel in channels]
+
+        return self._convert(channels, samples, reducer)
+
+    def read_oxidising(self):
+        """Return gas resistance for oxidising gases.
+
+        Eg chlorine, nitrous oxide
+        """
+        return self.read_channels(['oxidising'])[0]
+
+    def read_reducing(self):
+        """Return gas resistance for reducing gases.
+
+        Eg hydrogen, carbon monoxide
+        """
+        return self.read_channels(['reducing'])[0]
+
+    def read_nh3(self):
+        """Return gas resistance for nh3/ammonia"""
+        return self.read_channels(['nh3'])[0]
+
+    def read_adc(self):
+        """Return spare ADC channel value"""
+        if not self._adc_enabled:
+            return None
+        return self._convert(['adc'])[0]
+
+    def _check_read(self, channels, samples, reducer):
+        for channel in channels:
+            if channel not in MICS6814_CHANNELS:
+                raise ValueError("Channel must be one of {}".format(", ".join(MICS6814_CHANNELS)))
+        if reducer not in ('median', 'mean', 'trimmed'):
+            raise ValueError("Reducer must be one of 'median', 'mean' or 'trimmed'")
+        if samples < 1:
+            raise ValueError("Samples must be at least 1")
+
+    def _convert(self, channels, samples=1, reducer='median', cache_adc=False):
+        """Read channels from the ADC, bypassing the sampler's cache."""
+        self._setup_if_needed()
+
+        if not self._is_available:
+            raise RuntimeError("Gas sensor not connected.")
+
+        with self._adc_lock:
+            return [self._read_channel(channel, samples, reducer, cache_adc) for channel in channels]
+
+    def _setup_if_needed(self):
+        # After cleanup the ADC stays usable with the heater off until setup is called
+        if self._heater_off and self._is_available:
+            return
+        self.setup()
+
+    def _set_ready(self):
+        with self._lock:
+            if self._heater_on is None:
+                return
+            self._ready = True
+            callbacks = self._ready_callbacks
+            self._ready_callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def _reading(self, values, timestamp):
+        if self._heater_on is None:
+            status = 'off'
+        else:
+            status = 'valid' if self._ready else 'warming'
+        reading = Mics6814Reading(*values, timestamp=timestamp, status=status)
+        if self._compensation is not None:
+            # A failed environment read only loses compensation for this sample
+            try:
+                temperature, humidity = self._environment()
+            except Exception:
+                return reading
+            reading.compensated = self._compensation.apply(reading, temperature, humidity)
+        return reading
+
+    def _cached(self):
+        """Return the sampler's latest reading if it is fresh, otherwise None."""
+        with self._lock:
+            reading = self._latest
+            if reading is None or time.time() - reading.timestamp > self._max_age:
+                return None
+            return reading
+
+    def _run_sampler(self, interval):
+        channels = ['oxidising', 'reducing', 'nh3']
+        while not self._stop_sampler.is_set():
+            t_start = time.time()
+            adc = self._adc_enabled
+            try:
+                with self._adc_lock:
+                    values = [self._read_channel(channel, cache_adc=True) for channel in channels + (['adc'] if adc else [])]
+            except IOError:
+                values = None
+
+            if values is not None:
+                reading = self._reading(values, t_start)
+                with self._lock:
+                    self._latest = reading
+                    self.history.append(reading)
+
+            self._stop_sampler.wait(max(0, interval - (time.time() - t_start)))
+
+    def _read_channel(self, channel, samples=1, reducer='median', cache_adc=False):
+        if channel == 'adc':
+            if self._adc_gain == MICS6814_GAIN:
+                return self._read_voltage(MICS6814_CHANNELS['adc'], MICS6814_GAIN, samples, reducer)
+
+            # Only a gain switch makes the spare channel worth caching
+            t_now = time.time()
+            cache = cache_adc and samples == 1
+            if cache and self._adc_value is not None and t_now - self._adc_time < self._adc_interval:
+                return self._adc_value
+
+            # The new gain applies from the next conversion, which the read waits for
+            self.adc.set_programmable_gain(self._adc_gain)
+            self._mux = None
+            analog = self._read_voltage(MICS6814_CHANNELS['adc'], self._adc_gain, samples, reducer)
+            self.adc.set_programmable_gain(MICS6814_GAIN)
+            self._mux = None
+
+            if cache:
+                self._adc_value = analog
+                self._adc_time = t_now
+            return analog
+
+        voltage = self._read_voltage(MICS6814_CHANNELS[channel], MICS6814_GAIN, samples, reducer)
+        try:
+            return (voltage * MICS6814_LOAD_RESISTANCE) / (MICS6814_SUPPLY_VOLTAGE - voltage)
+        except ZeroDivisionError:
+            return 0
+
+    def _read_voltage(self, channel, gain, samples=1, reducer='median'):
+        """Return the voltage of one ADC input, reduced over samples conversions."""
+        if self.mode == 'single' and samples == 1:
+            return self.adc.get_voltage(channel)
+
+        # Bursts always run in continuous mode, then the ADC goes back to single-shot
+        period = MICS6814_CLOCK_MARGIN / self.sample_rate
+        if self.mode == 'continuous' and self._mux == channel:
+            # Still on this input, only wait for a conversion newer than the last one fetched
+            wait = self._last_fetch + period - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        else:
+            self._mux = None
+            self.adc.set_multiplexer(channel)
+            if self.mode == 'single':
+                self.adc.set_mode('continuous')
+            # The conversion in progress when the input changed may still complete on the old input
+            time.sleep(period * 2)
+        try:
+            if samples == 1:
+                value = self.adc.get_conversion_value()
+            else:
+                values = numpy.empty(samples, dtype='float64')
+                for i in range(samples):
+                    if i:
+                        time.sleep(period)
+                    values[i] = self.adc.get_conversion_value()
+                value = float(_reduce(values, reducer))
+        finally:
+            self._last_fetch = time.time()
+            if self.mode == 'single':
+                self.adc.set_mode('single')
+                self._mux = None
+            else:
+                self._mux = channel
+
+        full_scale = 32768.0 if self.adc_type == 'ADS1115' else 2048.0
+        return value * gain / full_scale
+
+
+def voltage_to_resistance(voltages, load_resistance=MICS6814_LOAD_RESISTANCE, supply_voltage=MICS6814_SUPPLY_VOLTAGE, masked=False):
+    """Convert raw sensor voltages to resistances in Ohms.
+
+    Works on whole arrays at once, eg N samples x 3 channels of stored voltages.
+    A voltage equal to the supply has no finite resistance and becomes NaN,
+    or is masked when masked is True.
+
+    :param voltages: Voltage or array of voltages
+    :param load_resistance: Load resistor in Ohms
+    :param supply_voltage: Supply voltage across the sensor and load resistor
+    :param masked: Return a numpy masked array instead of using NaN
+
+    """
+    voltages = numpy.asarray(voltages, dtype='float64')
+    divisor = supply_voltage - voltages
+    singular = divisor == 0
+    divisor = numpy.where(singular, numpy.nan, divisor)
+
+    resistances = voltages * load_resistance
+    resistances /= divisor
+
+    if masked:
+        return numpy.ma.masked_array(resistances, mask=singular)
+    return resistances
+
+
+def ratio_to_ppm(gas, ratios):
+    """Estimate concentration in ppm from Rs/R0 using the datasheet curves.
+
+    Interpolates MICS6814_PPM_CURVES in log-log space. Works on arrays of ratios,
+    values outside the range of the curve are NaN.
+
+    :param gas: One of "co", "no2", "nh3", "hydrogen" or "ethanol"
+    :param ratios: Ratio or array of ratios for the channel listed for the gas in MICS6814_PPM_CURVES
+
+    """
+    if gas not in _ppm_curves:
+        raise ValueError("Gas must be one of {}".format(", ".join(MICS6814_PPM_CURVES)))
+    channel, log_ratios, log_ppm = _ppm_curves[gas]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        log = numpy.log(ratios)
+    return numpy.exp(numpy.interp(log, log_ratios, log_ppm, left=numpy.nan, right=numpy.nan))
+
+
+def _reduce(values, reducer):
+    """Combine burst samples into one value along the last axis."""
+    if reducer == 'median':
+        return numpy.median(values, axis=-1)
+    if reducer == 'mean':
+        return numpy.mean(values, axis=-1)
+    count = values.shape[-1]
+    trim = max(int(count * TRIM_FRACTION), 1) if count >= 3 else 0
+    return numpy.mean(numpy.sort(values, axis=-1)[..., trim:count - trim], axis=-1)
+
+
+def _get_default():
+    """Return the MICS6814 on the Enviro+ used by the module-level functions."""
+    global _default
+    if _default is None:
+        _default = MICS6814()
+    return _default
+
+
 def setup():
-    global adc, adc_type, _is_setup, _is_available
-    if _is_setup:
-        return
-    _is_setup = True
-
-    try:
-        adc = ads1015.ADS1015(i2c_addr=0x49)
-        adc_type = adc.detect_chip_type()
-        _is_available = True
-    except IOError:
-        _is_available = False
-        return
-
-    adc.set_mode('single')
-    adc.set_programmable_gain(MICS6814_GAIN)
-    if adc_type == 'ADS1115':
-        adc.set_sample_rate(128)
-    else:
-        adc.set_sample_rate(1600)
-
-    GPIO.setwarnings(False)
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(MICS6814_HEATER_PIN, GPIO.OUT)
-    GPIO.output(MICS6814_HEATER_PIN, 1)
-    atexit.register(cleanup)
+    _get_default().setup()
 
 
 def available():
-    setup()
-    return _is_available
+    return _get_default().available()
+
+
+def set_mode(mode, sample_rate=None):
+    """Set the ADC conversion mode, "single" or "continuous".
+
+    :param mode: "single" or "continuous"
+    :param sample_rate: Optional ADC data rate in samples per second
+
+    """
+    _get_default().set_mode(mode, sample_rate)
+
 
+def heater_state():
+    """Return "off", "warming" or "valid"."""
+    return _get_default().heater_state()
 
-def enable_adc(value=True):
-    """Enable reading from the additional ADC pin."""
-    global _adc_enabled
-    _adc_enabled = value
+
+def warmup_remaining():
+    """Return seconds until the heater has warmed up, 0 once valid or None if it is off."""
+    return _get_default().warmup_remaining()
+
+
+def on_ready(callback):
+    """Call callback(sensor) once the heater has warmed up."""
+    _get_default().on_ready(callback)
+
+
+def ready_future():
+    """Return a concurrent.futures.Future resolved once the heater has warmed up."""
+    return _get_default().ready_future()
+
+
+def set_compensation(compensation, environment):
+    """Attach temperature and humidity compensated values to every reading.
+
+    :param compensation: Fitted Mics6814Compensation, or None to stop compensating
+    :param environment: Function returning (temperature in degrees C, relative humidity in %), eg from a BME280
+
+    """
+    _get_default().set_compensation(compensation, environment)
+
+
+def start_sampler(interval=1.0, history=60, max_age=None):
+    """Read all channels on a background thread and serve reads from the latest result.
+
+    :param interval: Seconds between readings
+    :param history: Number of recent readings kept in the sampler's Mics6814History
+    :param max_age: Seconds after which a cached reading is stale, defaults to twice the interval
+
+    """
+    _get_default().start_sampler(interval, history, max_age)
+
+
+def stop_sampler():
+    """Stop the background sampler."""
+    _get_default().stop_sampler()
+
+
+def get_latest():
+    """Return the sampler's latest reading, or None if there is none yet."""
+    return _get_default().get_latest()
+
+
+def get_history():
+    """Return a Mics6814History copy of the sampler's recent readings, oldest first."""
+    return _get_default().get_history()
+
+
+def enable_adc(value=True, interval=None):
+    """Enable reading from the additional ADC pin.
+
+    :param value: True to include the spare channel in readings
+    :param interval: Optional seconds between spare channel conversions in read_all, 0 to convert on every read
+
+    """
+    _get_default().enable_adc(value, interval)
 
 
 def set_adc_gain(value):
     """Set gain value for the additional ADC pin."""
-    global _adc_gain
-    _adc_gain = value
+    _get_default().set_adc_gain(value)
 
 
 def cleanup():
-    GPIO.output(MICS6814_HEATER_PIN, 0)
-
-
-def read_all():
-    """Return gas resistence for oxidising, reducing and NH3"""
-    setup()
+    _get_default().cleanup()
 
-    if not _is_available:
-        raise RuntimeError("Gas sensor not connected.")
 
-    ox = adc.get_voltage('in0/gnd')
-    red = adc.get_voltage('in1/gnd')
-    nh3 = adc.get_voltage('in2/gnd')
+def read_all(samples=1, reducer='median'):
+    """Return gas resistence for oxidising, reducing and NH3
 
-    try:
-        ox = (ox * 56000) / (3.3 - ox)
-    except ZeroDivisionError:
-        ox = 0
+    :param samples: Number of conversions per channel, taken in a burst and reduced to one value
+    :param reducer: How burst samples are combined, one of "median", "mean" or "trimmed"
 
-    try:
-        red = (red * 56000) / (3.3 - red)
-    except ZeroDivisionError:
-        red = 0
+    """
+    return _get_default().read_all(samples, reducer)
 
-    try:
-        nh3 = (nh3 * 56000) / (3.3 - nh3)
-    except ZeroDivisionError:
-        nh3 = 0
 
-    analog = None
+def read_channels(channels, samples=1, reducer='median'):
+    """Return values for a subset of channels, converting only the ADC inputs requested.
 
-    if _adc_enabled:
-        if _adc_gain == MICS6814_GAIN:
-            analog = adc.get_voltage('ref/gnd')
-        else:
-            adc.set_programmable_gain(_adc_gain)
-            time.sleep(0.05)
-            analog = adc.get_voltage('ref/gnd')
-            adc.set_programmable_gain(MICS6814_GAIN)
+    :param channels: List of channel names, any of "oxidising", "reducing", "nh3" and "adc"
+    :param samples: Number of conversions per channel, taken in a burst and reduced to one value
+    :param reducer: How burst samples are combined, one of "median", "mean" or "trimmed"
 
-    return Mics6814Reading(ox, red, nh3, analog)
+    """
+    return _get_default().read_channels(channels, samples, reducer)
 
 
 def read_oxidising():
@@ -135,7 +1200,7 @@ def read_oxidising():
 
     Eg chlorine, nitrous oxide
     """
-    return read_all().oxidising
+    return _get_default().read_oxidising()
 
 
 def read_reducing():
@@ -143,14 +1208,14 @@ def read_reducing():
 
     Eg hydrogen, carbon monoxide
     """
-    return read_all().reducing
+    return _get_default().read_reducing()
 
 
 def read_nh3():
     """Return gas resistance for nh3/ammonia"""
-    return read_all().nh3
+    return _get_default().read_nh3()
 
 
 def read_adc():
     """Return spare ADC channel value"""
-    return read_all().adc
+    return _get_default().read_adc()
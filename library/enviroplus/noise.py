@@ -1,34 +1,1300 @@
-import sounddevice
+import time
+import wave
+import queue
+import asyncio
+import inspect
+import datetime
+import threading
+import collections
 import numpy
 
 
+WELCH_SEGMENT_SIZE = 1024
+
+# Mean-square value of a full-scale sine, the 0 dBFS reference
+FULL_SCALE_POWER = 0.5
+
+# Base-ten octave frequency ratio and reference frequency from IEC 61260
+OCTAVE_RATIO = 10 ** (3 / 10.0)
+OCTAVE_REFERENCE = 1000.0
+OCTAVE_LOWEST = 10.0
+
+_weighting_curves = {}
+_rfft_out = None
+
+
+SpectralFeatures = collections.namedtuple('SpectralFeatures', ('centroid', 'flatness', 'rolloff', 'crest'))
+
+
+def weighting_curve(weighting, sample_rate, fft_size, band=None):
+    """Return the IEC 61672 frequency weighting for each bin of a one-sided spectrum.
+
+    Curves are calculated once per weighting, sample rate, FFT size and band and cached.
+
+    :param weighting: One of "A", "C" or "Z" (unweighted)
+    :param sample_rate: Sample rate in Hz
+    :param fft_size: Length of the FFT that produced the spectrum
+    :param band: Optional (start, end) frequency range in Hz, bins outside it are given zero gain
+
+    Returns an array of linear power gains.
+
+    """
+    weighting = weighting.upper()
+    key = (weighting, sample_rate, fft_size, None if band is None else tuple(band))
+    try:
+        return _weighting_curves[key]
+    except KeyError:
+        pass
+
+    frequencies = numpy.fft.rfftfreq(fft_size, 1.0 / sample_rate)
+    f2 = frequencies ** 2
+
+    if weighting == 'A':
+        gain = (12194.0 ** 2 * f2 ** 2) / (f2 + 20.6 ** 2) / (f2 + 12194.0 ** 2)
+        gain /= numpy.sqrt((f2 + 107.7 ** 2) * (f2 + 737.9 ** 2))
+        curve = gain ** 2 * 10 ** (2.00 / 10.0)
+    elif weighting == 'C':
+        gain = (12194.0 ** 2 * f2) / ((f2 + 20.6 ** 2) * (f2 + 12194.0 ** 2))
+        curve = gain ** 2 * 10 ** (0.06 / 10.0)
+    elif weighting == 'Z':
+        curve = numpy.ones(len(f2))
+    else:
+        raise ValueError("Weighting must be one of 'A', 'C' or 'Z'")
+
+    if band is not None:
+        start, end = band
+        curve = numpy.where((frequencies >= start) & (frequencies < end), curve, 0.0)
+
+    _weighting_curves[key] = curve
+    return curve
+
+
+def sound_level(samples, sample_rate, weighting='A', calibration=0.0, band=None):
+    """Return the equivalent continuous sound level of a block of samples.
+
+    :param samples: 1-D array of samples
+    :param sample_rate: Sample rate in Hz
+    :param weighting: Frequency weighting, one of "A", "C" or "Z"
+    :param calibration: Offset, in dB, added to the dBFS level
+    :param band: Optional (start, end) frequency range in Hz to restrict the level to
+
+    """
+    size = len(samples)
+    spectrum = numpy.fft.rfft(samples)
+    power = spectrum.real ** 2
+    power += spectrum.imag ** 2
+    power[1:(size + 1) // 2] *= 2
+    power = numpy.dot(power, weighting_curve(weighting, sample_rate, size, band)) / (size * size)
+    with numpy.errstate(divide='ignore'):
+        return 10 * numpy.log10(power / FULL_SCALE_POWER) + calibration
+
+
+class LevelStatistics():
+    def __init__(self,
+                 interval=None,
+                 resolution=0.1,
+                 min_level=-100.0,
+                 max_level=150.0,
+                 percentiles=(10, 50, 90),
+                 callback=None):
+        """Statistical sound level accumulator.
+
+        Levels are counted, weighted by duration, into a fixed-size histogram so memory use does not grow however long it runs.
+
+        :param interval: Length, in seconds, of each reporting interval. Statistics roll over when a level arrives in a new interval, None to accumulate until reset
+        :param resolution: Histogram bin width in dB, Ln percentiles are accurate to this value
+        :param min_level: Lowest level in the histogram, quieter levels are counted here
+        :param max_level: Highest level in the histogram, louder levels are counted here
+        :param percentiles: Ln values to include in each summary, eg: 90 for L90, the level exceeded 90% of the time
+        :param callback: Optional function called with the summary of each completed interval
+
+        """
+        self.interval = interval
+        self.resolution = resolution
+        self.min_level = min_level
+        self.max_level = max_level
+        self.percentiles = percentiles
+        self.callback = callback
+
+        self.last = None
+
+        self._lock = threading.Lock()
+        self._histogram = numpy.zeros(int(numpy.ceil((max_level - min_level) / resolution)) + 1, dtype='float64')
+        self._interval_index = None
+        self.reset()
+
+    def reset(self):
+        """Discard all accumulated levels."""
+        with self._lock:
+            self._reset()
+
+    def add(self, level, duration=1.0, timestamp=None):
+        """Add a sound level measurement.
+
+        :param level: Sound level in dB
+        :param duration: Time, in seconds, the level was measured over
+        :param timestamp: Time of the measurement, defaults to now
+
+        """
+        if level != level:
+            return
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        summary = None
+
+        with self._lock:
+            if self.interval is not None:
+                interval_index = int(timestamp // self.interval)
+                if interval_index != self._interval_index:
+                    if self._duration > 0:
+                        summary = self._summary()
+                        self.last = summary
+                    self._reset()
+                    self._interval_index = interval_index
+                    self._start = interval_index * self.interval
+
+            if self._start is None:
+                self._start = timestamp
+
+            index = int(round(min(max((level - self.min_level) / self.resolution, 0), len(self._histogram) - 1)))
+            self._histogram[index] += duration
+            self._energy += duration * 10 ** (level / 10.0)
+            self._duration += duration
+            self._lmax = max(self._lmax, level)
+            self._lmin = min(self._lmin, level)
+
+        if summary is not None and self.callback is not None:
+            self.callback(summary)
+
+    @property
+    def duration(self):
+        """Total duration, in seconds, of the accumulated levels."""
+        return self._duration
+
+    @property
+    def leq(self):
+        """Equivalent continuous sound level."""
+        with self._lock:
+            return self._leq()
+
+    @property
+    def lmax(self):
+        """Maximum sound level."""
+        return self._lmax if self._duration > 0 else None
+
+    @property
+    def lmin(self):
+        """Minimum sound level."""
+        return self._lmin if self._duration > 0 else None
+
+    def percentile(self, n):
+        """Return Ln, the sound level exceeded for n percent of the time.
+
+        :param n: Percentage of time, eg: 10 for L10
+
+        """
+        with self._lock:
+            return self._percentile(n)
+
+    def summary(self):
+        """Return a dictionary of statistics for the levels accumulated so far."""
+        with self._lock:
+            return self._summary()
+
+    def _reset(self):
+        self._histogram[:] = 0
+        self._energy = 0.0
+        self._duration = 0.0
+        self._lmax = float('-inf')
+        self._lmin = float('inf')
+        self._start = None
+
+    def _leq(self):
+        if self._duration <= 0:
+            return None
+        with numpy.errstate(divide='ignore'):
+            return 10 * numpy.log10(self._energy / self._duration)
+
+    def _percentile(self, n):
+        if self._duration <= 0:
+            return None
+        exceeded = numpy.cumsum(self._histogram[::-1])
+        index = len(self._histogram) - 1 - int(numpy.searchsorted(exceeded, self._duration * n / 100.0))
+        level = self.min_level + max(index, 0) * self.resolution
+        # Histogram bins can lie outside the measured range, eg n=0 finds the top bin
+        return min(max(level, self._lmin), self._lmax)
+
+    def _summary(self):
+        summary = {
+            'start': self._start,
+            'duration': self._duration,
+            'leq': self._leq(),
+            'lmax': self.lmax,
+            'lmin': self.lmin
+        }
+        for n in self.percentiles:
+            summary['l{}'.format(n)] = self._percentile(n)
+        return summary
+
+
+class _LevelMeter():
+    """Stream listener that splits samples into fixed-length frames and passes each frame's level and duration to callback."""
+
+    def __init__(self, callback, sample_rate, frame_size, weighting, calibration, band=None):
+        self.callback = callback
+        self.sample_rate = sample_rate
+        self.weighting = weighting
+        self.calibration = calibration
+        self.band = band
+        self._frame = numpy.zeros(frame_size, dtype='float64')
+        self._index = 0
+
+    def __call__(self, samples):
+        size = len(self._frame)
+        offset = 0
+        while offset < len(samples):
+            count = min(size - self._index, len(samples) - offset)
+            self._frame[self._index:self._index + count] = samples[offset:offset + count]
+            self._index += count
+            offset += count
+            if self._index == size:
+                self._index = 0
+                level = sound_level(self._frame, self.sample_rate, self.weighting, self.calibration, self.band)
+                self.callback(level, float(size) / self.sample_rate)
+
+
+class EventTrigger():
+    def __init__(self,
+                 path,
+                 threshold,
+                 sample_rate=16000,
+                 pre_roll=2.0,
+                 post_roll=3.0,
+                 weighting='A',
+                 band=None,
+                 frame_duration=0.125,
+                 calibration=0.0,
+                 dtype='float64',
+                 callback=None):
+        """Save the audio around loud events to disk.
+
+        Feed it blocks of samples as a Noise stream listener. When a frame's level reaches threshold the pre-roll is copied from an in-memory ring buffer and, once post_roll seconds more have arrived, the event is handed to a background thread to write so the audio path never waits on disk I/O.
+
+        The trigger re-arms once the level falls back below threshold, so one long loud event is saved once.
+
+        :param path: Output file name, formatted with the event time, eg: "event-{time:%Y%m%d-%H%M%S}.wav". Names ending .flac are written with the soundfile module
+        :param threshold: Level, in dB, that triggers an event
+        :param sample_rate: Sample rate in Hz
+        :param pre_roll: Seconds of audio to keep from before the trigger
+        :param post_roll: Seconds of audio to keep from after the trigger
+        :param weighting: Frequency weighting for the trigger level, one of "A", "C" or "Z"
+        :param band: Optional (start, end) frequency range in Hz to restrict the trigger level to
+        :param frame_duration: Duration, in seconds, of each level measurement
+        :param calibration: Offset, in dB, added to dBFS levels
+        :param dtype: Sample format of the stream
+        :param callback: Optional function called from the writer thread with the path and trigger level of each saved event
+
+        """
+        self.path = path
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.callback = callback
+        self.events = 0
+
+        self._soundfile = None
+        if path.lower().endswith('.flac'):
+            try:
+                import soundfile
+            except ImportError:
+                raise ImportError("Writing FLAC files requires the soundfile module.")
+            self._soundfile = soundfile
+
+        self._post_roll_size = int(post_roll * sample_rate)
+        self._pre_roll = numpy.zeros(int(pre_roll * sample_rate), dtype=dtype)
+        self._pre_roll_index = 0
+        self._pre_roll_count = 0
+        self._event = None
+        self._armed = True
+
+        frame_size = int(frame_duration * sample_rate)
+        weighting_curve(weighting, sample_rate, frame_size, band)
+        self._meter = _LevelMeter(self._check_level, sample_rate, frame_size, weighting, calibration, band)
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_events)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def __call__(self, samples):
+        if self._event is not None:
+            self._record_event(samples)
+        self._record_pre_roll(samples)
+        self._meter(samples)
+
+    def close(self):
+        """Finish writing any pending events and stop the writer thread."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _check_level(self, level, duration):
+        if level < self.threshold:
+            self._armed = True
+            return
+
+        if self._event is not None or not self._armed:
+            return
+        self._armed = False
+
+        size = len(self._pre_roll)
+        available = min(self._pre_roll_count, size)
+        audio = numpy.zeros(available + self._post_roll_size, dtype=self._pre_roll.dtype)
+        index = self._pre_roll_index
+        tail = audio[:available]
+        split = size - index if available == size else 0
+        tail[:split] = self._pre_roll[index:]
+        tail[split:] = self._pre_roll[:available - split]
+
+        self._event = [datetime.datetime.now(), level, audio, available]
+
+    def _record_event(self, samples):
+        when, level, audio, index = self._event
+        count = min(len(audio) - index, len(samples))
+        audio[index:index + count] = samples[:count]
+        index += count
+        if index < len(audio):
+            self._event[3] = index
+            return
+
+        self._event = None
+        self.events += 1
+        self._queue.put((when, level, audio))
+
+    def _record_pre_roll(self, samples):
+        size = len(self._pre_roll)
+        if size == 0:
+            return
+        if len(samples) >= size:
+            self._pre_roll[:] = samples[-size:]
+            self._pre_roll_index = 0
+        else:
+            index = self._pre_roll_index
+            end = index + len(samples)
+            if end <= size:
+                self._pre_roll[index:end] = samples
+            else:
+                split = size - index
+                self._pre_roll[index:] = samples[:split]
+                self._pre_roll[:end - size] = samples[split:]
+            self._pre_roll_index = end % size
+        self._pre_roll_count += len(samples)
+
+    def _write_events(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            when, level, audio = event
+            path = self.path.format(time=when)
+            if self._soundfile is not None:
+                self._soundfile.write(path, audio, self.sample_rate)
+            else:
+                with wave.open(path, 'wb') as wav:
+                    wav.setnchannels(1)
+                    wav.setsampwidth(2)
+                    wav.setframerate(self.sample_rate)
+                    wav.writeframes((numpy.clip(audio, -1.0, 32767 / 32768.0) * 32768).astype('<i2').tobytes())
+            if self.callback is not None:
+                self.callback(path, level)
+
+
+def spectral_features(magnitude, frequencies, rolloff=0.85):
+    """Return spectral shape features of a magnitude spectrum, or of a batch of spectra.
+
+    All features are computed together, vectorized along the last axis.
+
+    * centroid - magnitude-weighted mean frequency, in Hz
+    * flatness - geometric over arithmetic mean of the power spectrum, 0.0 (tonal) to 1.0 (white noise)
+    * rolloff - frequency, in Hz, below which the rolloff fraction of the spectral energy lies
+    * crest - ratio of the peak magnitude to the mean magnitude
+
+    :param magnitude: One-sided magnitude spectrum, or a 2-D array of one spectrum per row
+    :param frequencies: Frequency, in Hz, of each bin
+    :param rolloff: Fraction of spectral energy for the rolloff frequency
+
+    Returns a SpectralFeatures tuple of floats, or of arrays for a batch.
+
+    """
+    magnitude = numpy.asarray(magnitude, dtype='float64')
+    tiny = numpy.finfo('float64').tiny
+
+    total = numpy.sum(magnitude, axis=-1)
+    power = magnitude ** 2
+    cumulative = numpy.cumsum(power, axis=-1)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        centroid = numpy.dot(magnitude, frequencies) / total
+        flatness = numpy.exp(numpy.mean(numpy.log(power + tiny), axis=-1)) / (cumulative[..., -1] / power.shape[-1])
+        crest = numpy.max(magnitude, axis=-1) / (total / magnitude.shape[-1])
+
+    index = numpy.argmax(cumulative >= rolloff * cumulative[..., -1:], axis=-1)
+    rolloff = numpy.asarray(frequencies)[index]
+
+    return SpectralFeatures(centroid, flatness, rolloff, crest)
+
+
+def welch(samples, sample_rate, segment_size=WELCH_SEGMENT_SIZE, overlap=0.5, window=None):
+    """Estimate the one-sided power spectral density of a signal using Welch's method.
+
+    The signal is split into overlapping segments, which are windowed and
+    transformed as a single strided 2-D batch and their power averaged.
+
+    :param samples: 1-D array of samples
+    :param sample_rate: Sample rate in Hz
+    :param segment_size: Length, in samples, of each segment and its FFT
+    :param overlap: Fraction of each segment shared with the next (0.0 to <1.0)
+    :param window: Window applied to each segment, defaults to a Hann window
+
+    """
+    if window is None:
+        window = numpy.hanning(segment_size)
+
+    psd = _segment_power(samples, segment_size, overlap, window)
+    psd /= sample_rate * numpy.sum(window ** 2)
+    psd[1:(segment_size + 1) // 2] *= 2
+    return psd
+
+
+def _segment_power(samples, segment_size, overlap, window):
+    """Return the mean power spectrum, |X|^2, of windowed overlapping segments."""
+    spectra = numpy.fft.rfft(_segments(samples, segment_size, overlap) * window, axis=1)
+    power = spectra.real ** 2
+    power += spectra.imag ** 2
+    return power.mean(axis=0)
+
+
+def _segments(samples, segment_size, overlap):
+    """Return a read-only strided 2-D view of overlapping segments of samples."""
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("Overlap must be between 0.0 and 1.0")
+
+    samples = numpy.ascontiguousarray(samples)
+    if len(samples) < segment_size:
+        samples = numpy.concatenate((samples, numpy.zeros(segment_size - len(samples), dtype=samples.dtype)))
+
+    step = max(int(segment_size * (1.0 - overlap)), 1)
+    count = 1 + (len(samples) - segment_size) // step
+    stride = samples.strides[0]
+    return numpy.lib.stride_tricks.as_strided(samples, shape=(count, segment_size), strides=(stride * step, stride), writeable=False)
+
+
+def _rfft(samples, n, out, axis=-1):
+    """Real FFT into a preallocated output where numpy supports it (numpy >= 2.0)."""
+    global _rfft_out
+    if _rfft_out is None:
+        try:
+            _rfft_out = 'out' in inspect.signature(numpy.fft.rfft).parameters
+        except (TypeError, ValueError):
+            _rfft_out = False
+    if _rfft_out:
+        return numpy.fft.rfft(samples, n=n, axis=axis, out=out)
+    return numpy.fft.rfft(samples, n=n, axis=axis)
+
+
+def _set_future_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+class SpectrumBands():
+    def __init__(self, sample_rate, fft_size, cache_size=64):
+        """Prefix-sum band engine for one-sided spectra.
+
+        Converts frequency ranges to bin boundaries once and answers any
+        number of band queries on a spectrum with a single vectorized gather.
+
+        :param sample_rate: Sample rate in Hz
+        :param fft_size: Length of the FFT that produced the spectrum
+        :param cache_size: Maximum number of distinct band layouts to remember
+
+        """
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.bin_count = fft_size // 2 + 1
+        self.bin_width = sample_rate / float(fft_size)
+        self.frequencies = numpy.fft.rfftfreq(fft_size, 1.0 / sample_rate)
+        self.cache_size = cache_size
+
+        self._layouts = {}
+        self._cumulative = numpy.zeros(self.bin_count + 1, dtype='float64')
+
+    def bins(self, ranges):
+        """Return the start and end bin indices for a list of (start, end) frequency ranges.
+
+        :param ranges: List of ranges including a start and end frequency (in Hz)
+
+        """
+        key = tuple((start, end) for start, end in ranges)
+        try:
+            return self._layouts[key]
+        except KeyError:
+            pass
+
+        starts = []
+        ends = []
+        for start, end in key:
+            start = min(max(self.frequency_to_bin(start), 0), self.bin_count)
+            end = min(max(self.frequency_to_bin(end), start), self.bin_count)
+            starts.append(start)
+            ends.append(end)
+
+        layout = (
+            numpy.array(starts, dtype='intp'),
+            numpy.array(ends, dtype='intp'),
+            numpy.array(ends, dtype='float64') - numpy.array(starts, dtype='float64')
+        )
+
+        if len(self._layouts) >= self.cache_size:
+            self._layouts.clear()
+        self._layouts[key] = layout
+
+        return layout
+
+    def frequency_to_bin(self, frequency):
+        """Return the index of the bin containing the given frequency.
+
+        :param frequency: Frequency in Hz
+
+        """
+        return int(round(frequency * self.fft_size / float(self.sample_rate)))
+
+    def sums(self, spectrum, ranges):
+        """Return the sum of the spectrum over each range.
+
+        :param spectrum: One-sided spectrum with `bin_count` bins
+        :param ranges: List of ranges including a start and end frequency (in Hz)
+
+        """
+        starts, ends, _ = self.bins(ranges)
+        numpy.cumsum(spectrum, out=self._cumulative[1:])
+        return self._cumulative[ends] - self._cumulative[starts]
+
+    def means(self, spectrum, ranges):
+        """Return the mean of the spectrum over each range.
+
+        Empty ranges yield NaN.
+
+        :param spectrum: One-sided spectrum with `bin_count` bins
+        :param ranges: List of ranges including a start and end frequency (in Hz)
+
+        """
+        counts = self.bins(ranges)[2]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return self.sums(spectrum, ranges) / counts
+
+
+class SpectrogramHistory():
+    def __init__(self, frames, bins, quantise=False, db_min=-100.0, db_max=0.0):
+        """Fixed-size rolling history of spectral frames.
+
+        Each frame is written twice into a buffer of 2 x frames rows so the most recent frames are always contiguous and can be returned as a view without copying.
+
+        :param frames: Number of frames to keep
+        :param bins: Number of values in each frame
+        :param quantise: Store frames as uint8, mapping db_min..db_max to 0..255, instead of float32
+        :param db_min: Level stored as 0 when quantising
+        :param db_max: Level stored as 255 when quantising
+
+        """
+        self.frames = frames
+        self.bins = bins
+        self.quantise = quantise
+        self.db_min = db_min
+        self.db_max = db_max
+        self.count = 0
+
+        self._scale = 255.0 / (db_max - db_min)
+        self._storage = numpy.zeros((frames * 2, bins), dtype='uint8' if quantise else 'float32')
+        self._position = frames - 1
+
+    def push(self, frame):
+        """Add a frame, replacing the oldest once the history is full.
+
+        :param frame: Array of bins values, in dB when quantising
+
+        """
+        position = (self._position + 1) % self.frames
+        row = self._storage[position]
+        if self.quantise:
+            frame = numpy.clip((frame - self.db_min) * self._scale, 0, 255)
+            frame = numpy.rint(frame, out=frame)
+        row[:] = frame
+        self._storage[position + self.frames] = row
+        self._position = position
+        self.count += 1
+
+    def latest(self, n=None):
+        """Return a read-only view of the most recent frames, oldest first.
+
+        The view shares memory with the history, copy it to keep it beyond the next push.
+
+        :param n: Number of frames, defaults to all frames recorded so far up to the history size
+
+        """
+        available = min(self.count, self.frames)
+        if n is None or n > available:
+            n = available
+        end = self._position + self.frames + 1
+        view = self._storage[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def dequantise(self, frames):
+        """Convert quantised frames back to levels in dB.
+
+        :param frames: Array of uint8 values from latest()
+
+        """
+        return frames / self._scale + self.db_min
+
+
+class DeviceSource():
+    def __init__(self, device='adau7002'):
+        """Live audio from a sounddevice input.
+
+        :param device: Name or index of the input device
+
+        """
+        self.device = device
+        self.sample_rate = None
+
+    def read(self, frames, sample_rate, dtype='float64', out=None):
+        """Record and return a (frames, 1) array of samples.
+
+        :param frames: Number of frames to record
+        :param sample_rate: Sample rate in Hz
+        :param dtype: Sample format
+        :param out: Optional preallocated (frames, 1) array to record into
+
+        """
+        # Imported here so recorded-audio sources work without PortAudio
+        import sounddevice
+
+        if out is not None:
+            return sounddevice.rec(
+                device=self.device,
+                samplerate=sample_rate,
+                blocking=True,
+                channels=1,
+                dtype=dtype,
+                out=out
+            )
+
+        return sounddevice.rec(
+            frames,
+            device=self.device,
+            samplerate=sample_rate,
+            blocking=True,
+            channels=1,
+            dtype=dtype
+        )
+
+    def stream(self, callback, sample_rate, dtype='float64', block_size=0):
+        """Open and start a continuous input stream calling callback with each block.
+
+        :param callback: sounddevice stream callback
+        :param sample_rate: Sample rate in Hz
+        :param dtype: Sample format
+        :param block_size: Frames per callback, 0 lets the audio driver choose
+
+        """
+        import sounddevice
+
+        stream = sounddevice.InputStream(
+            device=self.device,
+            samplerate=sample_rate,
+            blocksize=block_size,
+            channels=1,
+            dtype=dtype,
+            callback=callback
+        )
+        stream.start()
+        return stream
+
+
+class ArraySource():
+    def __init__(self, data, sample_rate=None, loop=False):
+        """Recorded audio from a numpy array or a generator of arrays.
+
+        Reads return consecutive frames and raise EOFError once the data runs out.
+
+        :param data: Array of samples (1-D, or frames x channels using the first channel), or an iterable yielding such arrays
+        :param sample_rate: Sample rate of the data in Hz, if known
+        :param loop: Start again from the beginning when the data runs out, arrays only
+
+        """
+        self.sample_rate = sample_rate
+        self.loop = loop
+        self._data = data
+        self._chunks_iter = self._chunks()
+        self._chunk = None
+        self._offset = 0
+
+    def read(self, frames, sample_rate=None, dtype='float64', out=None):
+        """Return the next (frames, 1) array of samples.
+
+        :param frames: Number of frames to read
+        :param sample_rate: Ignored, recorded audio has a fixed sample rate
+        :param dtype: Sample format
+        :param out: Optional preallocated (frames, 1) array to read into
+
+        """
+        if out is None:
+            out = numpy.empty((frames, 1), dtype=dtype)
+
+        filled = 0
+        while filled < frames:
+            if self._chunk is None or self._offset >= len(self._chunk):
+                self._chunk = self._next_chunk()
+                self._offset = 0
+            count = min(frames - filled, len(self._chunk) - self._offset)
+            out[filled:filled + count, 0] = self._chunk[self._offset:self._offset + count]
+            self._offset += count
+            filled += count
+
+        return out
+
+    def _next_chunk(self):
+        while True:
+            try:
+                chunk = numpy.asarray(next(self._chunks_iter))
+            except StopIteration:
+                if not self.loop:
+                    raise EOFError("End of audio source.")
+                self._chunks_iter = self._chunks()
+                continue
+            if chunk.ndim > 1:
+                chunk = chunk[:, 0]
+            if len(chunk):
+                return chunk
+
+    def _chunks(self):
+        if isinstance(self._data, numpy.ndarray):
+            return iter((self._data,))
+        if self.loop:
+            raise ValueError("Only arrays can be looped")
+        return iter(self._data)
+
+
+class WavSource(ArraySource):
+    def __init__(self, path, loop=False, chunk_size=4096):
+        """Recorded audio from an uncompressed PCM WAV file.
+
+        The file is read incrementally, so it may be much larger than memory.
+
+        :param path: Path to the WAV file, the first channel is used
+        :param loop: Start again from the beginning of the file when it runs out
+        :param chunk_size: Number of frames to read from the file at a time
+
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        with wave.open(path, 'rb') as wav:
+            sample_rate = wav.getframerate()
+        ArraySource.__init__(self, None, sample_rate, loop)
+
+    def _chunks(self):
+        with wave.open(self.path, 'rb') as wav:
+            channels = wav.getnchannels()
+            width = wav.getsampwidth()
+            while True:
+                data = wav.readframes(self.chunk_size)
+                if not data:
+                    return
+                yield _pcm_to_float(data, width)[::channels]
+
+
+def _pcm_to_float(data, width):
+    """Convert little-endian PCM bytes to float64 samples in the range -1.0 to 1.0."""
+    if width == 1:
+        return (numpy.frombuffer(data, dtype='uint8') - 128.0) / 128.0
+    if width == 2:
+        return numpy.frombuffer(data, dtype='<i2') / 32768.0
+    if width == 3:
+        raw = numpy.frombuffer(data, dtype='uint8').reshape(-1, 3).astype('int32')
+        samples = (raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)
+        return (samples >> 8) / 8388608.0
+    if width == 4:
+        return numpy.frombuffer(data, dtype='<i4') / 2147483648.0
+    raise ValueError("Unsupported sample width: {} bytes".format(width))
+
+
+class CaptureService():
+    # Shared memory header fields, followed by one sequence number per slot and then the sample data
+    _HEADER = ('sequence', 'slots', 'block_size', 'sample_rate', 'itemsize')
+
+    def __init__(self,
+                 sample_rate=16000,
+                 block_size=512,
+                 dtype='float32',
+                 source=None,
+                 shared_memory=None,
+                 slots=64):
+        """Share one microphone stream between many consumers.
+
+        The audio device can only be opened once. The service owns it and publishes every block to in-process subscribers and, optionally, to a shared memory ring buffer that other processes read with SharedMemorySubscriber.
+
+        It is also an audio source, so several Noise instances can be created with source=service.
+
+        :param sample_rate: Sample rate in Hz
+        :param block_size: Frames per published block
+        :param dtype: Sample format, one of "float32" or "float64"
+        :param source: Live audio source, defaults to the adau7002 microphone
+        :param shared_memory: Optional name of a shared memory block to publish to (Python 3.8+)
+        :param slots: Number of blocks the shared memory ring buffer holds
+
+        """
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.dtype = dtype
+        self.source = source if source is not None else DeviceSource()
+        self.sequence = 0
+
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._stream = None
+        self._block = numpy.zeros(block_size, dtype=dtype)
+        self._block_index = 0
+
+        self._shm = None
+        if shared_memory is not None:
+            try:
+                from multiprocessing import shared_memory as shm
+            except ImportError:
+                raise RuntimeError("Publishing to shared memory requires Python 3.8 or later.")
+            itemsize = numpy.dtype(dtype).itemsize
+            header = len(self._HEADER) + slots
+            self._shm = shm.SharedMemory(name=shared_memory, create=True, size=8 * header + itemsize * slots * block_size)
+            self._header, self._slot_sequences, self._slot_data = _shared_ring(self._shm.buf, len(self._HEADER), slots, block_size, dtype)
+            self._header[:] = (0, slots, block_size, sample_rate, itemsize)
+            self._slot_sequences[:] = -1
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Open the audio device and start publishing."""
+        if self._stream is None:
+            self._stream = self.source.stream(self._callback, self.sample_rate, self.dtype, self.block_size)
+
+    def stop(self):
+        """Close the audio device and release the shared memory."""
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        if self._shm is not None:
+            self._header = self._slot_sequences = self._slot_data = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def subscribe(self, callback):
+        """Call callback, on the audio thread, with every block of the stream.
+
+        Starts the service if it is not running.
+
+        :param callback: Function with the sounddevice stream callback signature: (indata, frames, time, status)
+
+        """
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+        self.start()
+
+    def unsubscribe(self, callback):
+        """Stop calling callback with stream blocks."""
+        with self._lock:
+            self._subscribers = [subscriber for subscriber in self._subscribers if subscriber is not callback]
+
+    def stream(self, callback, sample_rate=None, dtype=None, block_size=None):
+        """Audio source interface, subscribes callback and returns a handle whose stop method unsubscribes it."""
+        self.subscribe(callback)
+        return _Subscription(self, callback)
+
+    def read(self, frames, sample_rate=None, dtype='float64', out=None):
+        """Audio source interface, wait for and return the next (frames, 1) array of samples.
+
+        :param frames: Number of frames to read
+        :param sample_rate: Ignored, the service's sample rate is used
+        :param dtype: Sample format
+        :param out: Optional preallocated (frames, 1) array to read into
+
+        """
+        if out is None:
+            out = numpy.empty((frames, 1), dtype=dtype)
+        collector = _Collector(out)
+        self.subscribe(collector)
+        try:
+            if not collector.done.wait(float(frames) / self.sample_rate + 1.0):
+                raise RuntimeError("Timed out waiting for audio stream.")
+        finally:
+            self.unsubscribe(collector)
+        return out
+
+    def _callback(self, indata, frames, time_info, status):
+        for subscriber in self._subscribers:
+            subscriber(indata, frames, time_info, status)
+
+        if self._shm is None:
+            return
+
+        samples = indata[:, 0]
+        offset = 0
+        while offset < frames:
+            count = min(self.block_size - self._block_index, frames - offset)
+            self._block[self._block_index:self._block_index + count] = samples[offset:offset + count]
+            self._block_index += count
+            offset += count
+            if self._block_index == self.block_size:
+                self._block_index = 0
+                self._publish(self._block)
+
+    def _publish(self, block):
+        sequence = self.sequence + 1
+        slot = sequence % len(self._slot_sequences)
+        self._slot_sequences[slot] = -1
+        self._slot_data[slot] = block
+        self._slot_sequences[slot] = sequence
+        self._header[0] = sequence
+        self.sequence = sequence
+
+
+class SharedMemorySubscriber():
+    def __init__(self, name, dtype='float32'):
+        """Read the audio stream published to shared memory by a CaptureService in another process.
+
+        Blocks are read in order from the moment of subscribing. A reader that falls more than the ring size behind skips to the oldest block still available and counts the blocks it missed in dropped.
+
+        It is also an audio source, so it can be passed to Noise as source.
+
+        :param name: Name of the shared memory block given to CaptureService
+        :param dtype: Sample format the CaptureService publishes
+
+        """
+        from multiprocessing import shared_memory as shm
+        self._shm = shm.SharedMemory(name=name)
+        try:
+            # The publishing process owns the block, stop this process unlinking it on exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        except (ImportError, AttributeError):
+            pass
+        header = numpy.ndarray((len(CaptureService._HEADER),), dtype='int64', buffer=self._shm.buf)
+        _, slots, self.block_size, self.sample_rate, _ = (int(value) for value in header)
+        self._header, self._slot_sequences, self._slot_data = _shared_ring(self._shm.buf, len(CaptureService._HEADER), slots, self.block_size, dtype)
+        self.sequence = int(self._header[0])
+        self.dropped = 0
+        self._source = ArraySource(self._blocks())
+
+    def close(self):
+        """Detach from the shared memory."""
+        self._header = self._slot_sequences = self._slot_data = None
+        self._source = None
+        self._shm.close()
+
+    def read_block(self, timeout=None, poll=0.001):
+        """Wait for and return the next block as a tuple of its sequence number and a copy of its samples.
+
+        :param timeout: Seconds to wait before raising RuntimeError, None to wait forever
+        :param poll: Seconds between checks for a new block
+
+        """
+        t_start = time.time()
+        while True:
+            latest = int(self._header[0])
+            if latest > self.sequence:
+                slots = len(self._slot_sequences)
+                sequence = max(self.sequence + 1, latest - slots + 1)
+                self.dropped += sequence - self.sequence - 1
+                slot = sequence % slots
+                block = self._slot_data[slot].copy()
+                self.sequence = sequence
+                if self._slot_sequences[slot] == sequence:
+                    return sequence, block
+                # Overwritten while copying, move on to the oldest block still available
+                self.dropped += 1
+                continue
+            if timeout is not None and time.time() - t_start > timeout:
+                raise RuntimeError("Timed out waiting for audio stream.")
+            time.sleep(poll)
+
+    def read(self, frames, sample_rate=None, dtype='float64', out=None):
+        """Audio source interface, wait for and return the next (frames, 1) array of samples."""
+        return self._source.read(frames, sample_rate, dtype, out)
+
+    def _blocks(self):
+        while True:
+            yield self.read_block(timeout=1.0)[1]
+
+
+class _Subscription():
+    """Stream handle returned by CaptureService.stream."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+
+    def stop(self):
+        self.service.unsubscribe(self.callback)
+
+    def close(self):
+        pass
+
+
+class _Collector():
+    """CaptureService subscriber that fills one array then signals done."""
+
+    def __init__(self, out):
+        self.out = out
+        self.index = 0
+        self.done = threading.Event()
+
+    def __call__(self, indata, frames, time_info, status):
+        count = min(len(self.out) - self.index, frames)
+        if count > 0:
+            self.out[self.index:self.index + count] = indata[:count]
+            self.index += count
+            if self.index == len(self.out):
+                self.done.set()
+
+
+def _shared_ring(buf, header_size, slots, block_size, dtype):
+    """Return the header, slot sequence and slot data arrays of a shared memory ring buffer."""
+    header = numpy.ndarray((header_size,), dtype='int64', buffer=buf)
+    sequences = numpy.ndarray((slots,), dtype='int64', buffer=buf, offset=8 * header_size)
+    data = numpy.ndarray((slots, block_size), dtype=dtype, buffer=buf, offset=8 * (header_size + slots))
+    return header, sequences, data
+
+
 class Noise():
     def __init__(self,
                  sample_rate=16000,
-                 duration=0.5):
+                 duration=0.5,
+                 fft_size=None,
+                 method='fft',
+                 overlap=0.5,
+                 calibration=0.0,
+                 dtype='float64',
+                 source=None,
+                 stream=False):
         """Noise measurement.
 
         :param sample_rate: Sample rate in Hz
         :param duraton: Duration, in seconds, of noise sample capture
+        :param fft_size: FFT length, defaults to the smallest power of two that holds a whole capture (or WELCH_SEGMENT_SIZE for "welch"). For "fft" it must hold the whole capture, use "welch" for shorter segments
+        :param method: Spectrum estimator, either "fft" for a single FFT of the whole capture or "welch" to average windowed, overlapping segments of fft_size samples
+        :param overlap: Fraction of each segment shared with the next when using "welch"
+        :param calibration: Offset, in dB, added to dBFS sound levels to give dB SPL
+        :param dtype: Sample format, "float32" halves buffer sizes and records straight into a reused buffer
+        :param source: Audio source, defaults to the adau7002 microphone. Use ArraySource or WavSource to analyse recorded audio
+        :param stream: Capture continuously in the background instead of recording on every call
 
         """
 
         self.duration = duration
         self.sample_rate = sample_rate
+        self.source = source if source is not None else DeviceSource()
+
+        if self.source.sample_rate not in (None, sample_rate):
+            raise ValueError("Source sample rate {} does not match {}".format(self.source.sample_rate, sample_rate))
+
+        if method not in ('fft', 'welch'):
+            raise ValueError("Method must be one of 'fft' or 'welch'")
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError("Overlap must be between 0.0 and 1.0")
+        if dtype not in ('float32', 'float64'):
+            raise ValueError("Dtype must be one of 'float32' or 'float64'")
+        self.method = method
+        self.overlap = overlap
+        self.calibration = calibration
+        self.dtype = dtype
+
+        capture_size = int(self.duration * self.sample_rate)
+        if fft_size is None:
+            fft_size = 1 << max(capture_size - 1, 1).bit_length()
+            if method == 'welch':
+                fft_size = min(fft_size, WELCH_SEGMENT_SIZE)
+        if fft_size < 2:
+            raise ValueError("FFT size must be at least 2")
+        # A shorter FFT would only see the start of the capture
+        if method == 'fft' and fft_size < capture_size:
+            raise ValueError("FFT size {} is shorter than the {} sample capture, use method='welch' to analyse it in segments".format(fft_size, capture_size))
+        self.fft_size = int(fft_size)
+
+        self._bands = SpectrumBands(self.sample_rate, self.fft_size)
+        self._window = numpy.hanning(self.fft_size).astype(dtype)
+        self._octave_bands = {}
+        self.history = None
+
+        # Analysis buffers are allocated once and reused for every capture
+        complex_dtype = 'complex64' if dtype == 'float32' else 'complex128'
+        self._recording = numpy.zeros((capture_size, 1), dtype=dtype)
+        self._spectrum = numpy.zeros(self._bands.bin_count, dtype=complex_dtype)
+        self._magnitude_buffer = numpy.zeros(self._bands.bin_count, dtype=dtype)
+        self._power_buffer = numpy.zeros(self._bands.bin_count, dtype='float64')
+        self._level_buffer = numpy.zeros(self._bands.bin_count, dtype='float64')
+        if method == 'welch':
+            segment_count = _segments(self._recording[:, 0], self.fft_size, overlap).shape[0]
+            self._windowed = numpy.zeros((segment_count, self.fft_size), dtype=dtype)
+            self._segment_spectra = numpy.zeros((segment_count, self._bands.bin_count), dtype=complex_dtype)
+            self._segment_power = numpy.zeros((segment_count, self._bands.bin_count), dtype=dtype)
+
+        # Converts |X|^2 to each bin's share of the signal's mean-square value
+        bin_scale = numpy.full(self._bands.bin_count, 2.0)
+        bin_scale[0] = 1.0
+        if self.fft_size % 2 == 0:
+            bin_scale[-1] = 1.0
+        if method == 'welch':
+            self._power_scale = bin_scale / (self.fft_size * numpy.sum(self._window ** 2))
+        else:
+            self._power_scale = bin_scale / (self.fft_size * capture_size)
+
+        self._stream = None
+        self._lock = threading.Lock()
+        self._buffer = None
+        self._buffer_index = 0
+        self._buffer_full = threading.Event()
+        self._listeners = []
+        self._waiters = []
+        self._window_count = 0
+
+        # Captures and completed stream windows are numbered so history gets one frame per capture
+        self._windows = 0
+        self._capture = 0
+        self._history_capture = None
+
+        if stream:
+            self.start_stream()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_stream()
+
+    def start_stream(self):
+        """Start continuous capture into a ring buffer.
+
+        While the stream is running every query method analyses the most
+        recent `duration` seconds of audio instead of making a new recording.
+
+        """
+        if self._stream is not None:
+            return
+
+        if not hasattr(self.source, 'stream'):
+            raise RuntimeError("Streaming requires a live audio source.")
+
+        self._buffer = numpy.zeros(int(self.duration * self.sample_rate), dtype=self.dtype)
+        self._buffer_index = 0
+        self._buffer_full.clear()
+        self._window_count = 0
+
+        self._stream = self.source.stream(self._stream_callback, self.sample_rate, self.dtype)
+
+    def stop_stream(self):
+        """Stop continuous capture and release the audio device."""
+        if self._stream is None:
+            return
+
+        self._stream.stop()
+        self._stream.close()
+        self._stream = None
+
+    def add_listener(self, listener):
+        """Register a function to be called with each new block of samples from the stream.
+
+        Listeners run on the audio thread and must return quickly.
+
+        :param listener: Function accepting a 1-D array of samples, only valid for the duration of the call
+
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Unregister a stream listener."""
+        self._listeners.remove(listener)
+
+    def attach_statistics(self, statistics, weighting='A', frame_duration=0.125):
+        """Feed a LevelStatistics from the stream.
+
+        The stream is split into frames, each frame's sound level is added to statistics. Starts the stream if it is not running.
+
+        :param statistics: LevelStatistics instance to update
+        :param weighting: Frequency weighting, one of "A", "C" or "Z"
+        :param frame_duration: Duration, in seconds, of each level, 0.125 is "fast" and 1.0 is "slow"
+
+        Returns the listener, pass it to remove_listener to detach.
+
+        """
+        frame_size = int(frame_duration * self.sample_rate)
+        weighting_curve(weighting, self.sample_rate, frame_size)
+        listener = _LevelMeter(statistics.add, self.sample_rate, frame_size, weighting, self.calibration)
+        self.add_listener(listener)
+        self.start_stream()
+        return listener
+
+    def attach_trigger(self, path, threshold, **kwargs):
+        """Save the audio around loud events from the stream.
+
+        Creates an EventTrigger for this stream's sample rate, format and calibration and starts the stream if it is not running. See EventTrigger for the remaining arguments.
+
+        :param path: Output file name, formatted with the event time, eg: "event-{time:%Y%m%d-%H%M%S}.wav"
+        :param threshold: Level, in dB, that triggers an event
+
+        Returns the EventTrigger, pass it to remove_listener to detach and call its close method to finish writing.
+
+        """
+        trigger = EventTrigger(path, threshold, sample_rate=self.sample_rate, calibration=self.calibration, dtype=self.dtype, **kwargs)
+        self.add_listener(trigger)
+        self.start_stream()
+        return trigger
+
+    def enable_history(self, frames, quantise=False, db_min=-100.0, db_max=0.0):
+        """Keep a rolling spectrogram of every analysed capture.
+
+        Each new capture analysed adds one frame to history holding the level of each FFT bin, in dBFS plus the calibration offset.
+        While streaming that is one frame per `duration` of audio, however often the query methods are called.
+
+        :param frames: Number of captures to keep
+        :param quantise: Store levels as uint8, mapping db_min..db_max to 0..255
+        :param db_min: Level stored as 0 when quantising
+        :param db_max: Level stored as 255 when quantising
+
+        Returns the SpectrogramHistory, also available as the history attribute.
+
+        """
+        self.history = SpectrogramHistory(frames, self._bands.bin_count, quantise, db_min, db_max)
+        return self.history
+
+    @property
+    def streaming(self):
+        """True if continuous capture is running."""
+        return self._stream is not None
 
     def get_amplitudes_at_frequency_ranges(self, ranges):
         """Return the mean amplitude of frequencies in the given ranges.
 
-        :param ranges: List of ranges including a start and end range
+        :param ranges: List of ranges including a start and end frequency (in Hz)
 
         """
-        recording = self._record()
-        magnitude = numpy.abs(numpy.fft.rfft(recording[:, 0], n=self.sample_rate))
-        result = []
-        for r in ranges:
-            start, end = r
-            result.append(numpy.mean(magnitude[start:end]))
-        return result
+        return list(self._band_means(self._record(), ranges))
 
     def get_amplitude_at_frequency_range(self, start, end):
         """Return the mean amplitude of frequencies in the specified range.
@@ -37,13 +1303,8 @@ class Noise():
         :param end: End frequency (in Hz)
 
         """
-        n = self.sample_rate // 2
-        if start > n or end > n:
-            raise ValueError("Maxmimum frequency is {}".format(n))
-
-        recording = self._record()
-        magnitude = numpy.abs(numpy.fft.rfft(recording[:, 0], n=self.sample_rate))
-        return numpy.mean(magnitude[start:end])
+        self._check_frequency_range(start, end)
+        return self._band_means(self._record(), [(start, end)])[0]
 
     def get_noise_profile(self,
                           noise_floor=100,
@@ -60,12 +1321,113 @@ class Noise():
         :param high: Optional percentage for high bin, effectively creates a "Low-pass" if total percentage is less than 100%
 
         """
+        return self._noise_profile(self._record(), noise_floor, low, mid, high)
+
+    async def record_async(self):
+        """Wait for the next complete window of `duration` seconds from the stream.
+
+        Every coroutine waiting at the same time receives the same window, so any number of consumers share one capture. Starts the stream if it is not running.
+
+        Returns a read-only (frames, 1) array.
+
+        """
+        self.start_stream()
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.append((loop, future))
+        capture, window = await future
+        self._capture = capture
+        return window
+
+    async def get_amplitudes_at_frequency_ranges_async(self, ranges):
+        """Asynchronous version of get_amplitudes_at_frequency_ranges, see record_async."""
+        return list(self._band_means(await self.record_async(), ranges))
+
+    async def get_amplitude_at_frequency_range_async(self, start, end):
+        """Asynchronous version of get_amplitude_at_frequency_range, see record_async."""
+        self._check_frequency_range(start, end)
+        return self._band_means(await self.record_async(), [(start, end)])[0]
+
+    async def get_noise_profile_async(self, noise_floor=100, low=0.12, mid=0.36, high=None):
+        """Asynchronous version of get_noise_profile, see record_async."""
+        return self._noise_profile(await self.record_async(), noise_floor, low, mid, high)
+
+    async def get_octave_band_levels_async(self, fraction=1, weighting='Z'):
+        """Asynchronous version of get_octave_band_levels, see record_async."""
+        return self._octave_band_levels(await self.record_async(), fraction, weighting)
+
+    def get_sound_level(self, weighting='A'):
+        """Return the equivalent continuous sound level (Leq) of a capture.
+
+        Levels are in dBFS, where 0 dBFS is a full-scale sine, plus the calibration offset.
+
+        :param weighting: Frequency weighting, one of "A", "C" or "Z"
+
+        """
+        return self.get_sound_levels((weighting,))[0]
+
+    def get_sound_levels(self, weightings=('A', 'C', 'Z')):
+        """Return the equivalent continuous sound level for several weightings of a single capture.
+
+        :param weightings: Sequence of frequency weightings, each one of "A", "C" or "Z"
+
+        """
+        power = self._power(self._magnitude(self._record()))
+        return [self._level(numpy.dot(power, weighting_curve(w, self.sample_rate, self.fft_size))) for w in weightings]
+
+    def get_octave_band_levels(self, fraction=1, weighting='Z'):
+        """Return octave or fractional-octave band levels from a single capture.
+
+        Bands follow IEC 61260 base-ten mid-band frequencies, from 10Hz up to the highest band below the Nyquist frequency. Bands too narrow to contain an FFT bin are omitted.
+
+        Returns a tuple of mid-band frequencies (in Hz) and band levels in dBFS plus the calibration offset.
+
+        :param fraction: Bands per octave, 1 for octave or 3 for third-octave bands
+        :param weighting: Frequency weighting applied before banding, one of "A", "C" or "Z"
+
+        """
+        return self._octave_band_levels(self._record(), fraction, weighting)
+
+    def get_spectral_features(self, rolloff=0.85, frame_size=None):
+        """Return spectral shape features of a capture.
+
+        See spectral_features for a description of each feature.
+
+        :param rolloff: Fraction of spectral energy for the rolloff frequency
+        :param frame_size: Optionally split the capture into Hann-windowed frames of this many samples and return arrays with the features of each frame
+
+        """
+        recording = self._record()
+        if frame_size is None:
+            return spectral_features(self._magnitude(recording), self._bands.frequencies, rolloff)
+
+        frames = _segments(recording[:, 0], frame_size, 0.0)
+        magnitude = numpy.abs(numpy.fft.rfft(frames * numpy.hanning(frame_size), axis=1))
+        return spectral_features(magnitude, numpy.fft.rfftfreq(frame_size, 1.0 / self.sample_rate), rolloff)
+
+    def get_psd(self):
+        """Return the Welch-averaged power spectral density of a capture.
+
+        Returns a tuple of frequencies (in Hz) and the one-sided PSD (in full-scale units squared per Hz), using segments of fft_size samples.
+
+        """
+        recording = self._record()
+        return self._bands.frequencies, welch(recording[:, 0], self.sample_rate, self.fft_size, self.overlap, self._window)
+
+    def _check_frequency_range(self, start, end):
+        n = self.sample_rate // 2
+        if start > n or end > n:
+            raise ValueError("Maxmimum frequency is {}".format(n))
+
+    def _band_means(self, recording, ranges):
+        return self._bands.means(self._magnitude(recording), ranges)
 
+    def _noise_profile(self, recording, noise_floor, low, mid, high):
         if high is None:
             high = 1.0 - low - mid
 
-        recording = self._record()
-        magnitude = numpy.abs(numpy.fft.rfft(recording[:, 0], n=self.sample_rate))
+        magnitude = self._magnitude(recording)
 
         sample_count = (self.sample_rate // 2) - noise_floor
 
@@ -73,19 +1435,151 @@ class Noise():
         high_start = mid_start + int(sample_count * mid)
         noise_ceiling = high_start + int(sample_count * high)
 
-        amp_low = numpy.mean(magnitude[noise_floor:mid_start])
-        amp_mid = numpy.mean(magnitude[mid_start:high_start])
-        amp_high = numpy.mean(magnitude[high_start:noise_ceiling])
-        amp_total = (amp_low + amp_mid + amp_high) / 3.0
+        amps = self._bands.means(magnitude, [
+            (noise_floor, mid_start),
+            (mid_start, high_start),
+            (high_start, noise_ceiling)
+        ])
+        amp_total = numpy.mean(amps)
+
+        return amps[0], amps[1], amps[2], amp_total
+
+    def _octave_band_levels(self, recording, fraction, weighting):
+        centres, ranges = self._octave_layout(fraction)
+        power = self._power(self._magnitude(recording))
+        power *= weighting_curve(weighting, self.sample_rate, self.fft_size)
+        return centres, self._level(self._bands.sums(power, ranges))
 
-        return amp_low, amp_mid, amp_high, amp_total
+    def _octave_layout(self, fraction):
+        try:
+            return self._octave_bands[fraction]
+        except KeyError:
+            pass
+
+        if fraction < 1:
+            raise ValueError("Fraction must be a positive number of bands per octave")
+
+        nyquist = self.sample_rate / 2.0
+        half_band = OCTAVE_RATIO ** (1.0 / (2 * fraction))
+        first = int(numpy.ceil(fraction * numpy.log(OCTAVE_LOWEST / OCTAVE_REFERENCE) / numpy.log(OCTAVE_RATIO)))
+
+        centres = []
+        ranges = []
+        x = first
+        while True:
+            centre = OCTAVE_REFERENCE * OCTAVE_RATIO ** (float(x) / fraction)
+            if centre * half_band > nyquist:
+                break
+            lower = centre / half_band
+            upper = centre * half_band
+            if self._bands.frequency_to_bin(upper) > self._bands.frequency_to_bin(lower):
+                centres.append(centre)
+                ranges.append((lower, upper))
+            x += 1
+
+        layout = numpy.array(centres), ranges
+        self._octave_bands[fraction] = layout
+        return layout
+
+    def _power(self, magnitude):
+        """Return each bin's share of the mean-square value of the capture."""
+        power = numpy.multiply(magnitude, magnitude, out=self._power_buffer)
+        power *= self._power_scale
+        return power
+
+    def _level(self, power):
+        with numpy.errstate(divide='ignore'):
+            return 10 * numpy.log10(power / FULL_SCALE_POWER) + self.calibration
+
+    def _magnitude(self, recording):
+        """Return the magnitude spectrum of a capture, in a buffer reused by the next call."""
+        if self.method == 'welch':
+            windowed = numpy.multiply(_segments(recording[:, 0], self.fft_size, self.overlap), self._window, out=self._windowed)
+            power = numpy.abs(_rfft(windowed, self.fft_size, self._segment_spectra, axis=1), out=self._segment_power)
+            numpy.square(power, out=power)
+            magnitude = numpy.mean(power, axis=0, out=self._magnitude_buffer)
+            magnitude = numpy.sqrt(magnitude, out=magnitude)
+        else:
+            magnitude = numpy.abs(_rfft(recording[:, 0], self.fft_size, self._spectrum), out=self._magnitude_buffer)
+
+        if self.history is not None and self._history_capture != self._capture:
+            self._history_capture = self._capture
+            levels = numpy.multiply(self._power(magnitude), 1.0 / FULL_SCALE_POWER, out=self._level_buffer)
+            with numpy.errstate(divide='ignore'):
+                numpy.log10(levels, out=levels)
+            levels *= 10
+            levels += self.calibration
+            self.history.push(levels)
+
+        return magnitude
 
     def _record(self):
-        return sounddevice.rec(
-            int(self.duration * self.sample_rate),
-            device='adau7002',
-            samplerate=self.sample_rate,
-            blocking=True,
-            channels=1,
-            dtype='float64'
-        )
+        if self._stream is not None:
+            return self._read_buffer()
+
+        with self._lock:
+            self._windows += 1
+            self._capture = self._windows
+        frames = int(self.duration * self.sample_rate)
+        if self.dtype == 'float32':
+            return self.source.read(frames, self.sample_rate, self.dtype, out=self._recording)
+
+        return self.source.read(frames, self.sample_rate, self.dtype)
+
+    def _read_buffer(self):
+        """Return the most recent window from the ring buffer, oldest sample first."""
+        if not self._buffer_full.wait(self.duration + 1.0):
+            raise RuntimeError("Timed out waiting for audio stream.")
+
+        recording = self._recording[:, 0]
+        with self._lock:
+            self._capture = self._windows
+            index = self._buffer_index
+            tail = len(self._buffer) - index
+            recording[:tail] = self._buffer[index:]
+            recording[tail:] = self._buffer[:index]
+
+        return self._recording
+
+    def _stream_callback(self, indata, frames, time_info, status):
+        samples = indata[:, 0]
+        size = len(self._buffer)
+
+        with self._lock:
+            if frames >= size:
+                self._buffer[:] = samples[-size:]
+                self._buffer_index = 0
+                full = True
+            else:
+                index = self._buffer_index
+                end = index + frames
+                if end <= size:
+                    self._buffer[index:end] = samples
+                else:
+                    split = size - index
+                    self._buffer[index:] = samples[:split]
+                    self._buffer[:end - size] = samples[split:]
+                self._buffer_index = end % size
+                full = end >= size
+
+            self._window_count += frames
+            if self._window_count >= size:
+                self._window_count = 0
+                self._windows += 1
+                windows = self._windows
+                waiters = self._waiters
+                self._waiters = []
+            else:
+                waiters = None
+
+        if full:
+            self._buffer_full.set()
+
+        if waiters:
+            window = numpy.concatenate((self._buffer[self._buffer_index:], self._buffer[:self._buffer_index])).reshape(-1, 1)
+            window.flags.writeable = False
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_set_future_result, future, (windows, window))
+
+        for listener in self._listeners:
+            listener(samples)
@@ -109,7 +109,11 @@ def sounddevice():
 @pytest.fixture(scope='function', autouse=False)
 def numpy():
     """Mock numpy module."""
+    real_numpy = sys.modules.get('numpy')
     numpy = mock.MagicMock()
     sys.modules['numpy'] = numpy
     yield numpy
-    del sys.modules['numpy']
+    if real_numpy is not None:
+        sys.modules['numpy'] = real_numpy
+    else:
+        del sys.modules['numpy']
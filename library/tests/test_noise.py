@@ -46,3 +46,574 @@ def test_get_amplitude_at_frequency_range(sounddevice, numpy):
 
     with pytest.raises(ValueError):
         noise.get_amplitude_at_frequency_range(0, 16000)
+
+
+def test_noise_stream(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    noise = Noise(sample_rate=16000, duration=0.1, stream=True)
+    assert noise.streaming
+
+    callback = sounddevice.InputStream.call_args[1]['callback']
+    samples = numpy.arange(2000, dtype='float64').reshape(-1, 1)
+    callback(samples[:1000], 1000, None, None)
+    callback(samples[1000:], 1000, None, None)
+
+    recording = noise._record()
+    assert recording.shape == (1600, 1)
+    assert recording[0, 0] == 400
+    assert recording[-1, 0] == 1999
+
+    noise.get_noise_profile()
+    sounddevice.rec.assert_not_called()
+
+    noise.stop_stream()
+    assert not noise.streaming
+    sounddevice.InputStream.return_value.close.assert_called_once()
+
+
+def test_spectrum_bands(sounddevice):
+    import numpy
+    from enviroplus.noise import SpectrumBands
+
+    bands = SpectrumBands(16000, 16000)
+    spectrum = numpy.random.random(8001)
+    ranges = [(100, 500), (501, 1000), (7000, 9000), (600, 600), (900, 800)]
+
+    means = bands.means(spectrum, ranges)
+    for (start, end), mean in zip(ranges[:3], means):
+        assert numpy.isclose(mean, numpy.mean(spectrum[start:end]))
+    assert numpy.isnan(means[3])
+    assert numpy.isnan(means[4])
+
+    assert bands.bins(ranges) is bands.bins(list(ranges))
+
+
+def test_noise_fft_size(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    assert Noise(sample_rate=16000, duration=0.5).fft_size == 8192
+    assert Noise(sample_rate=16000, duration=0.1).fft_size == 2048
+
+    t = numpy.arange(8000) / 16000.0
+    sounddevice.rec.return_value = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+
+    for fft_size in (None, 8000, 16000):
+        noise = Noise(sample_rate=16000, duration=0.5, fft_size=fft_size)
+        tone, other = noise.get_amplitudes_at_frequency_ranges([(950, 1050), (1950, 2050)])
+        assert tone > other * 10
+
+    with pytest.raises(ValueError):
+        Noise(fft_size=1)
+
+    # A single FFT shorter than the capture would ignore most of it
+    with pytest.raises(ValueError):
+        Noise(sample_rate=16000, duration=0.5, fft_size=1024)
+    assert Noise(sample_rate=16000, duration=0.5, fft_size=1024, method='welch').fft_size == 1024
+
+
+def test_welch(sounddevice):
+    import numpy
+    from enviroplus.noise import welch
+
+    samples = numpy.random.normal(0.0, 0.1, 16000)
+    psd = welch(samples, 16000, segment_size=512)
+
+    assert psd.shape == (257,)
+    assert numpy.isclose(numpy.sum(psd) * 16000 / 512.0, numpy.var(samples), rtol=0.1)
+
+    with pytest.raises(ValueError):
+        welch(samples, 16000, overlap=1.0)
+
+
+def test_noise_welch(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    t = numpy.arange(8000) / 16000.0
+    sounddevice.rec.return_value = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+
+    noise = Noise(sample_rate=16000, duration=0.5, method='welch')
+    assert noise.fft_size == 1024
+
+    tone, other = noise.get_amplitudes_at_frequency_ranges([(950, 1050), (1950, 2050)])
+    assert tone > other * 10
+
+    frequencies, psd = noise.get_psd()
+    assert frequencies[numpy.argmax(psd)] == 1000
+
+    with pytest.raises(ValueError):
+        Noise(method='median')
+
+
+def test_weighting_curve(sounddevice):
+    import numpy
+    from enviroplus.noise import weighting_curve
+
+    curve = weighting_curve('A', 16000, 16000)
+    assert curve is weighting_curve('a', 16000, 16000)
+    assert numpy.isclose(10 * numpy.log10(curve[1000]), 0.0, atol=0.01)
+    assert numpy.isclose(10 * numpy.log10(curve[100]), -19.1, atol=0.1)
+
+    curve = weighting_curve('C', 16000, 16000)
+    assert numpy.isclose(10 * numpy.log10(curve[1000]), 0.0, atol=0.01)
+    assert numpy.isclose(10 * numpy.log10(curve[100]), -0.3, atol=0.1)
+
+    with pytest.raises(ValueError):
+        weighting_curve('B', 16000, 16000)
+
+
+def test_noise_sound_level(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    t = numpy.arange(8000) / 16000.0
+
+    for method in ('fft', 'welch'):
+        sounddevice.rec.return_value = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+        noise = Noise(sample_rate=16000, duration=0.5, method=method, calibration=94.0)
+        la, lc, lz = noise.get_sound_levels()
+        assert numpy.isclose(la, 94.0, atol=0.2)
+        assert numpy.isclose(lc, 94.0, atol=0.2)
+        assert numpy.isclose(lz, 94.0, atol=0.2)
+
+        sounddevice.rec.return_value = 0.1 * numpy.sin(2 * numpy.pi * 100 * t).reshape(-1, 1)
+        noise = Noise(sample_rate=16000, duration=0.5, method=method)
+        assert numpy.isclose(noise.get_sound_level('Z'), -20.0, atol=0.2)
+        assert numpy.isclose(noise.get_sound_level('A'), -39.1, atol=0.5)
+
+
+def test_noise_octave_band_levels(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    t = numpy.arange(8000) / 16000.0
+    sounddevice.rec.return_value = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+
+    noise = Noise(sample_rate=16000, duration=0.5)
+
+    centres, levels = noise.get_octave_band_levels(fraction=1)
+    assert len(centres) == len(levels)
+    assert numpy.isclose(centres[numpy.argmax(levels)], 1000)
+    assert numpy.isclose(numpy.max(levels), 0.0, atol=0.2)
+
+    centres, levels = noise.get_octave_band_levels(fraction=3, weighting='A')
+    assert numpy.isclose(centres[numpy.argmax(levels)], 1000)
+    assert centres[-1] * 10 ** (3 / 60.0) <= 8000
+    assert numpy.isclose(10 * numpy.log10(numpy.sum(10 ** (levels / 10))), noise.get_sound_level('A'), atol=0.1)
+
+
+def test_level_statistics(sounddevice):
+    import numpy
+    from enviroplus.noise import LevelStatistics
+
+    summaries = []
+    statistics = LevelStatistics(interval=60, callback=summaries.append)
+
+    for second, level in enumerate(range(40, 140)):
+        statistics.add(float(level), timestamp=second * 0.5)
+
+    assert statistics.lmax == 139.0
+    assert statistics.lmin == 40.0
+    assert numpy.isclose(statistics.percentile(10), 130.0, atol=0.2)
+    assert numpy.isclose(statistics.percentile(50), 90.0, atol=0.2)
+    assert numpy.isclose(statistics.percentile(90), 50.0, atol=0.2)
+    assert statistics.percentile(0) == 139.0
+    assert statistics.percentile(100) == 40.0
+    assert numpy.isclose(statistics.leq, 10 * numpy.log10(numpy.mean(10 ** (numpy.arange(40, 140) / 10.0))))
+
+    statistics.add(50.0, timestamp=60.0)
+    assert len(summaries) == 1
+    assert summaries[0] is statistics.last
+    assert summaries[0]['start'] == 0
+    assert summaries[0]['duration'] == 100
+    assert summaries[0]['lmax'] == 139.0
+    assert statistics.duration == 1.0
+    assert statistics.lmax == 50.0
+
+
+def test_noise_attach_statistics(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise, LevelStatistics
+
+    noise = Noise(sample_rate=16000, duration=0.1)
+    statistics = LevelStatistics()
+    noise.attach_statistics(statistics, weighting='Z', frame_duration=0.125)
+    assert noise.streaming
+
+    callback = sounddevice.InputStream.call_args[1]['callback']
+    t = numpy.arange(16000) / 16000.0
+    samples = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+    for block in range(0, 16000, 512):
+        callback(samples[block:block + 512], len(samples[block:block + 512]), None, None)
+
+    assert statistics.duration == 1.0
+    assert numpy.isclose(statistics.leq, 0.0, atol=0.1)
+
+
+def test_noise_float32(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    t = numpy.arange(8000) / 16000.0
+    recording = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+
+    for method in ('fft', 'welch'):
+        sounddevice.rec.return_value = recording
+        expected = Noise(method=method).get_sound_level('Z')
+
+        noise = Noise(method=method, dtype='float32')
+        noise._recording[:] = recording
+        sounddevice.rec.return_value = noise._recording
+
+        assert numpy.isclose(noise.get_sound_level('Z'), expected, atol=0.01)
+        assert sounddevice.rec.call_args[1]['out'] is noise._recording
+        assert sounddevice.rec.call_args[1]['dtype'] == 'float32'
+
+        assert noise._magnitude(noise._record()) is noise._magnitude_buffer
+        assert noise._magnitude_buffer.dtype == numpy.float32
+
+    with pytest.raises(ValueError):
+        Noise(dtype='int16')
+
+
+def test_array_source(sounddevice):
+    import numpy
+    from enviroplus.noise import ArraySource, Noise
+
+    source = ArraySource(numpy.arange(10.0))
+    assert source.read(4)[:, 0].tolist() == [0, 1, 2, 3]
+    assert source.read(6)[:, 0].tolist() == [4, 5, 6, 7, 8, 9]
+    with pytest.raises(EOFError):
+        source.read(1)
+
+    source = ArraySource(numpy.arange(4.0), loop=True)
+    assert source.read(6)[:, 0].tolist() == [0, 1, 2, 3, 0, 1]
+
+    source = ArraySource(numpy.ones((n, 2)) * n for n in (3, 1, 2))
+    assert source.read(5)[:, 0].tolist() == [3, 3, 3, 1, 2]
+
+    t = numpy.arange(16000) / 16000.0
+    noise = Noise(sample_rate=16000, duration=0.5, source=ArraySource(numpy.sin(2 * numpy.pi * 1000 * t), 16000))
+    assert numpy.isclose(noise.get_sound_level('Z'), 0.0, atol=0.1)
+    assert numpy.isclose(noise.get_sound_level('Z'), 0.0, atol=0.1)
+    with pytest.raises(EOFError):
+        noise.get_noise_profile()
+    with pytest.raises(RuntimeError):
+        noise.start_stream()
+    with pytest.raises(ValueError):
+        Noise(sample_rate=16000, source=ArraySource(t, 44100))
+
+    sounddevice.rec.assert_not_called()
+
+
+def test_array_source_without_sounddevice(monkeypatch):
+    import sys
+    import numpy
+
+    # A None entry makes "import sounddevice" fail, as on a host without PortAudio
+    monkeypatch.setitem(sys.modules, 'sounddevice', None)
+    from enviroplus.noise import ArraySource, Noise
+
+    t = numpy.arange(8000) / 16000.0
+    noise = Noise(sample_rate=16000, duration=0.5, source=ArraySource(numpy.sin(2 * numpy.pi * 1000 * t), 16000))
+    assert numpy.isclose(noise.get_sound_level('Z'), 0.0, atol=0.1)
+
+    with pytest.raises(ImportError):
+        Noise(sample_rate=16000, duration=0.5).get_noise_profile()
+
+
+def test_wav_source(sounddevice, tmp_path):
+    import wave
+    import numpy
+    from enviroplus.noise import WavSource
+
+    samples = (numpy.sin(numpy.arange(1000) / 10.0) * 16384).astype('<i2')
+    for width, data in ((2, samples.tobytes()),
+                        (3, numpy.column_stack((numpy.zeros(1000, 'uint8'), samples.view('uint8').reshape(-1, 2))).tobytes())):
+        path = str(tmp_path / 'test{}.wav'.format(width))
+        with wave.open(path, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(width)
+            wav.setframerate(8000)
+            wav.writeframes(data)
+
+        source = WavSource(path, chunk_size=300)
+        assert source.sample_rate == 8000
+        assert numpy.allclose(source.read(1000)[:, 0], samples / 32768.0)
+        with pytest.raises(EOFError):
+            source.read(1)
+
+
+def test_noise_throughput(sounddevice):
+    """Analysis of recorded audio must comfortably outpace real time."""
+    import time
+    import numpy
+    from enviroplus.noise import Noise, ArraySource
+
+    audio = numpy.random.normal(0.0, 0.1, 16000 * 10)
+
+    for method in ('fft', 'welch'):
+        noise = Noise(sample_rate=16000, duration=0.5, method=method, source=ArraySource(audio, 16000, loop=True))
+        analyses = (
+            noise.get_noise_profile,
+            lambda: noise.get_amplitudes_at_frequency_ranges([(f, f + 200) for f in range(100, 6100, 200)]),
+            noise.get_sound_levels,
+            lambda: noise.get_octave_band_levels(fraction=3),
+            noise.get_psd
+        )
+        for analysis in analyses:
+            t_start = time.time()
+            for _ in range(40):
+                analysis()
+            assert time.time() - t_start < 40 * 0.5 / 10
+
+
+def test_spectral_features(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise, ArraySource, spectral_features
+
+    frequencies = numpy.arange(101) * 10.0
+
+    tone = numpy.zeros(101)
+    tone[50] = 1.0
+    white = numpy.ones(101)
+
+    features = spectral_features(tone, frequencies)
+    assert features.centroid == 500.0
+    assert features.rolloff == 500.0
+    assert features.flatness < 0.01
+    assert features.crest == 101.0
+
+    features = spectral_features(white, frequencies)
+    assert numpy.isclose(features.centroid, 500.0)
+    assert numpy.isclose(features.flatness, 1.0)
+    assert features.rolloff == 850.0
+    assert features.crest == 1.0
+
+    batch = spectral_features(numpy.vstack((tone, white)), frequencies)
+    assert batch.centroid.shape == (2,)
+    assert numpy.allclose(batch.flatness, [spectral_features(tone, frequencies).flatness, 1.0])
+
+    t = numpy.arange(8000) / 16000.0
+    noise = Noise(sample_rate=16000, duration=0.5, source=ArraySource(numpy.sin(2 * numpy.pi * 1000 * t), loop=True))
+    features = noise.get_spectral_features()
+    assert numpy.isclose(features.centroid, 1000.0, rtol=0.2)
+    assert numpy.isclose(features.rolloff, 1000.0, rtol=0.01)
+
+    features = noise.get_spectral_features(frame_size=1024)
+    assert features.centroid.shape == (7,)
+    assert numpy.allclose(features.rolloff, 1000.0, rtol=0.02)
+
+
+def test_spectrogram_history(sounddevice):
+    import numpy
+    from enviroplus.noise import SpectrogramHistory
+
+    history = SpectrogramHistory(4, 3)
+    assert history.latest().shape == (0, 3)
+
+    for n in range(6):
+        history.push(numpy.full(3, n))
+
+    assert history.latest()[:, 0].tolist() == [2, 3, 4, 5]
+    assert history.latest(2)[:, 0].tolist() == [4, 5]
+    assert numpy.shares_memory(history.latest(), history._storage)
+    assert not history.latest().flags.writeable
+
+    history = SpectrogramHistory(2, 3, quantise=True, db_min=-100.0, db_max=0.0)
+    history.push(numpy.array([-200.0, -60.0, 10.0]))
+    assert history.latest().dtype == numpy.uint8
+    assert history.latest()[0].tolist() == [0, 102, 255]
+    assert numpy.allclose(history.dequantise(history.latest())[0], [-100.0, -60.0, 0.0], atol=0.1)
+
+
+def test_noise_history(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise, ArraySource
+
+    t = numpy.arange(8000) / 16000.0
+    noise = Noise(sample_rate=16000, duration=0.5, source=ArraySource(numpy.sin(2 * numpy.pi * 1000 * t), loop=True))
+    history = noise.enable_history(10, quantise=True)
+
+    for _ in range(3):
+        noise.get_noise_profile()
+
+    frames = noise.history.latest()
+    assert frames.shape == (3, 4097)
+    assert numpy.argmax(frames[-1]) == noise._bands.frequency_to_bin(1000)
+    assert history is noise.history
+
+
+def test_noise_attach_trigger(sounddevice, tmp_path):
+    import wave
+    import numpy
+    from enviroplus.noise import Noise
+
+    events = []
+    noise = Noise(sample_rate=16000, duration=0.1)
+    trigger = noise.attach_trigger(
+        str(tmp_path / 'event-{time:%H%M%S%f}.wav'), -10.0,
+        pre_roll=0.5, post_roll=0.25, weighting='Z', band=(500, 2000),
+        callback=lambda path, level: events.append((path, level)))
+    assert noise.streaming
+
+    callback = sounddevice.InputStream.call_args[1]['callback']
+    t = numpy.arange(16000) / 16000.0
+    quiet = 0.001 * numpy.sin(2 * numpy.pi * 1000 * t)
+    loud = numpy.sin(2 * numpy.pi * 1000 * t)
+    hum = numpy.sin(2 * numpy.pi * 100 * t)
+
+    for audio in (quiet, hum, loud, quiet):
+        for block in range(0, 16000, 1000):
+            samples = audio[block:block + 1000].reshape(-1, 1)
+            callback(samples, len(samples), None, None)
+
+    trigger.close()
+
+    assert trigger.events == 1
+    assert len(events) == 1
+    path, level = events[0]
+    assert numpy.isclose(level, 0.0, atol=0.1)
+
+    with wave.open(path, 'rb') as wav:
+        assert wav.getnframes() == 8000 + 4000
+        audio = numpy.frombuffer(wav.readframes(12000), dtype='<i2') / 32768.0
+
+    assert numpy.max(numpy.abs(audio[:4000])) > 0.9
+    assert numpy.max(numpy.abs(audio[-4000:])) > 0.9
+
+
+def test_noise_async(sounddevice):
+    import asyncio
+    import numpy
+    from enviroplus.noise import Noise
+
+    noise = Noise(sample_rate=16000, duration=0.1)
+    t = numpy.arange(1600) / 16000.0
+    samples = numpy.sin(2 * numpy.pi * 1000 * t).reshape(-1, 1)
+
+    async def main():
+        consumers = asyncio.gather(
+            noise.record_async(),
+            noise.record_async(),
+            noise.get_noise_profile_async(),
+            noise.get_amplitude_at_frequency_range_async(900, 1100),
+            noise.get_octave_band_levels_async())
+        await asyncio.sleep(0)
+
+        callback = sounddevice.InputStream.call_args[1]['callback']
+        callback(samples[:1000], 1000, None, None)
+        callback(samples[1000:], 600, None, None)
+
+        return await consumers
+
+    loop = asyncio.new_event_loop()
+    try:
+        first, second, profile, amplitude, (centres, levels) = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    sounddevice.InputStream.assert_called_once()
+    sounddevice.rec.assert_not_called()
+    assert first is second
+    assert numpy.array_equal(first, samples)
+    assert len(profile) == 4
+    assert amplitude > profile[3]
+    assert numpy.isclose(centres[numpy.argmax(levels)], 1000)
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(ValueError):
+            loop.run_until_complete(noise.get_amplitude_at_frequency_range_async(0, 16000))
+    finally:
+        loop.close()
+
+
+def test_capture_service(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise, CaptureService
+
+    service = CaptureService(sample_rate=16000, block_size=400)
+    display = Noise(sample_rate=16000, duration=0.1, source=service, stream=True)
+    logger = Noise(sample_rate=16000, duration=0.1, source=service, stream=True)
+    sounddevice.InputStream.assert_called_once()
+    assert sounddevice.InputStream.call_args[1]['blocksize'] == 400
+
+    callback = sounddevice.InputStream.call_args[1]['callback']
+    samples = numpy.arange(2000, dtype='float32').reshape(-1, 1)
+    for block in range(0, 2000, 400):
+        callback(samples[block:block + 400], 400, None, None)
+
+    assert numpy.array_equal(display._record(), samples[400:])
+    assert numpy.array_equal(logger._record(), samples[400:])
+
+    logger.stop_stream()
+    assert service._subscribers == [display._stream_callback]
+
+    with pytest.raises(ValueError):
+        Noise(sample_rate=44100, source=service)
+
+    service.stop()
+    sounddevice.InputStream.return_value.close.assert_called_once()
+
+
+def test_capture_service_shared_memory(sounddevice):
+    pytest.importorskip('multiprocessing.shared_memory')
+    import os
+    import numpy
+    from enviroplus.noise import CaptureService, SharedMemorySubscriber
+
+    name = 'enviroplus-test-{}'.format(os.getpid())
+    with CaptureService(sample_rate=16000, block_size=100, shared_memory=name, slots=4):
+        callback = sounddevice.InputStream.call_args[1]['callback']
+        subscriber = SharedMemorySubscriber(name)
+        assert subscriber.sample_rate == 16000
+        assert subscriber.block_size == 100
+
+        samples = numpy.arange(1000, dtype='float32').reshape(-1, 1)
+        callback(samples[:150], 150, None, None)
+        callback(samples[150:300], 150, None, None)
+
+        sequence, block = subscriber.read_block(timeout=0)
+        assert sequence == 1
+        assert numpy.array_equal(block, samples[:100, 0])
+
+        callback(samples[300:], 700, None, None)
+        sequence, block = subscriber.read_block(timeout=0)
+        assert sequence == 7
+        assert numpy.array_equal(block, samples[600:700, 0])
+        assert subscriber.dropped == 5
+
+        assert numpy.array_equal(subscriber.read(250)[:, 0], samples[700:950, 0])
+        with pytest.raises(RuntimeError):
+            subscriber.read_block(timeout=0)
+        subscriber.close()
+
+
+def test_noise_history_once_per_capture(sounddevice):
+    import numpy
+    from enviroplus.noise import Noise
+
+    noise = Noise(sample_rate=16000, duration=0.1, stream=True)
+    noise.enable_history(10)
+    callback = sounddevice.InputStream.call_args[1]['callback']
+    block = numpy.random.uniform(-0.1, 0.1, (1600, 1))
+
+    callback(block, 1600, None, None)
+    for _ in range(20):
+        noise.get_noise_profile()
+    noise.get_sound_levels()
+    noise.get_octave_band_levels()
+    assert len(noise.history.latest()) == 1
+
+    callback(block[:800], 800, None, None)
+    noise.get_noise_profile()
+    assert len(noise.history.latest()) == 1
+
+    callback(block[:800], 800, None, None)
+    noise.get_noise_profile()
+    noise.get_sound_levels()
+    assert len(noise.history.latest()) == 2
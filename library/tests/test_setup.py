@@ -1,3 +1,4 @@
+import mock
 import pytest
 
 
@@ -83,3 +84,495 @@ def test_gas_cleanup(GPIO, smbus):
     gas.cleanup()
 
     GPIO.output.assert_called_with(gas.MICS6814_HEATER_PIN, 0)
+
+
+def test_gas_multiple_boards(GPIO, smbus):
+    from enviroplus import gas
+
+    first = gas.MICS6814()
+    second = gas.MICS6814(i2c_addr=0x48, heater_pin=23)
+
+    assert int(first.read_oxidising()) == 16641
+    assert int(second.read_all().nh3) == 16813
+    assert first.adc is not second.adc
+    assert second.adc._i2c_addr == 0x48
+
+    GPIO.output.assert_any_call(gas.MICS6814_HEATER_PIN, 1)
+    GPIO.output.assert_any_call(23, 1)
+
+    second.cleanup()
+    GPIO.output.assert_called_with(23, 0)
+
+
+def test_gas_no_heater_pin(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814(heater_pin=None)
+    assert sensor.available()
+    sensor.cleanup()
+    GPIO.output.assert_not_called()
+
+
+def test_gas_read_channels(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814()
+    sensor.setup()
+    get_voltage = sensor.adc.get_voltage
+    sensor.adc.get_voltage = mock.Mock(side_effect=get_voltage)
+
+    nh3, ox = sensor.read_channels(['nh3', 'oxidising'])
+    assert int(nh3) == 16813
+    assert int(ox) == 16641
+    assert sensor.adc.get_voltage.call_count == 2
+
+    sensor.adc.get_voltage.reset_mock()
+    assert int(sensor.read_reducing()) == 16727
+    sensor.adc.get_voltage.assert_called_once_with('in1/gnd')
+
+    assert sensor.read_adc() is None
+    sensor.enable_adc(True)
+    sensor.set_adc_gain(gas.MICS6814_GAIN)
+    assert sensor.read_adc() == 0.765
+
+    assert int(gas.read_channels(['oxidising'])[0]) == 16641
+
+    with pytest.raises(ValueError):
+        sensor.read_channels(['co2'])
+
+
+def test_gas_read_all_burst(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814()
+    single = sensor.read_all()
+
+    for reducer in ('median', 'mean', 'trimmed'):
+        result = sensor.read_all(samples=5, reducer=reducer)
+        assert round(result.oxidising) == round(single.oxidising)
+        assert round(result.reducing) == round(single.reducing)
+        assert round(result.nh3) == round(single.nh3)
+
+    assert sensor.adc.get_mode() == 'single'
+
+    with pytest.raises(ValueError):
+        sensor.read_all(samples=5, reducer='max')
+    with pytest.raises(ValueError):
+        sensor.read_all(samples=0)
+    with pytest.raises(ValueError):
+        sensor.read_channels(['nh3'], samples=-1)
+
+
+def test_gas_reduce(GPIO, smbus):
+    import numpy
+    from enviroplus.gas import _reduce
+
+    values = numpy.array([1.0, 2.0, 3.0, 4.0, 100.0])
+    assert _reduce(values, 'median') == 3.0
+    assert _reduce(values, 'mean') == 22.0
+    assert _reduce(values, 'trimmed') == 3.0
+    assert _reduce(numpy.array([1.0, 3.0]), 'trimmed') == 2.0
+
+
+def test_gas_continuous_mode(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814()
+    single = sensor.read_all()
+
+    sensor.set_mode('continuous', sample_rate=3300)
+    assert sensor.adc.get_mode() == 'continuous'
+    assert sensor.sample_rate == 3300
+
+    result = sensor.read_all()
+    assert round(result.oxidising) == round(single.oxidising)
+    assert round(result.reducing) == round(single.reducing)
+    assert round(result.nh3) == round(single.nh3)
+
+    result = sensor.read_all(samples=3)
+    assert round(result.nh3) == round(single.nh3)
+    assert sensor.adc.get_mode() == 'continuous'
+
+    with pytest.raises(ValueError):
+        sensor.set_mode('burst')
+
+
+def test_gas_continuous_mode_setup(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814(mode='continuous')
+    assert sensor.read_oxidising() == pytest.approx(16641, abs=1)
+    assert sensor.adc.get_mode() == 'continuous'
+    assert sensor.sample_rate == 1600
+
+
+def test_gas_sampler(GPIO, smbus):
+    import time
+    from enviroplus import gas
+
+    sensor = gas.MICS6814()
+    sensor.start_sampler(interval=0.01, history=5)
+
+    t_start = time.time()
+    while len(sensor.history) < 5 and time.time() - t_start < 5:
+        time.sleep(0.01)
+
+    assert len(sensor.history) == 5
+    latest = sensor.get_latest()
+    assert latest.timestamp is not None
+    assert int(latest.oxidising) == 16641
+
+    with mock.patch.object(sensor, '_read_channel') as read_channel:
+        sensor._max_age = 60
+        assert sensor.read_all() is sensor.get_latest()
+        assert sensor.read_channels(['reducing', 'nh3']) is not None
+        read_channel.assert_not_called()
+
+    sensor.stop_sampler()
+    assert sensor.get_latest() is None
+    assert int(sensor.read_nh3()) == 16813
+
+
+def test_gas_sampler_module(GPIO, smbus):
+    import time
+    from enviroplus import gas
+
+    gas.start_sampler(interval=0.01, history=3)
+
+    t_start = time.time()
+    while gas.get_latest() is None and time.time() - t_start < 5:
+        time.sleep(0.01)
+
+    gas.stop_sampler()
+    assert len(gas.get_history()) >= 1
+    assert gas.get_latest() is None
+
+
+def test_gas_adc_interval(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814()
+    sensor.enable_adc(True, interval=60)
+    sensor.set_adc_gain(2.048)
+    assert round(sensor.read_all().adc, 3) == 0.255
+
+    with mock.patch.object(sensor.adc, 'set_programmable_gain') as set_gain:
+        assert round(sensor.read_all().adc, 3) == 0.255
+        set_gain.assert_not_called()
+
+        # An explicit read always converts
+        sensor.read_adc()
+        assert set_gain.call_count == 2
+
+        sensor.enable_adc(True, interval=0)
+        sensor.read_all()
+        sensor.read_all()
+        assert set_gain.call_count == 6
+
+
+def test_gas_adc_interval_same_gain(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814()
+    sensor.enable_adc(True, interval=60)
+    sensor.set_adc_gain(gas.MICS6814_GAIN)
+    sensor.read_all()
+
+    # Without a gain switch the spare channel costs the same as a gas channel and is never cached
+    with mock.patch.object(sensor, '_read_voltage', return_value=0.5) as read_voltage:
+        assert sensor.read_all().adc == 0.5
+        assert read_voltage.call_count == 4
+
+
+def test_gas_voltage_to_resistance(GPIO, smbus):
+    import numpy
+    from enviroplus.gas import voltage_to_resistance
+
+    voltages = numpy.array([[1.1, 2.2, 3.3], [0.0, 1.65, 3.3]])
+    resistances = voltage_to_resistance(voltages)
+    assert resistances.shape == (2, 3)
+    assert resistances[0, 0] == pytest.approx(28000)
+    assert resistances[1, 1] == pytest.approx(56000)
+    assert resistances[1, 0] == 0
+    assert numpy.isnan(resistances[:, 2]).all()
+
+    masked = voltage_to_resistance(voltages, masked=True)
+    assert masked.mask[:, 2].all()
+    assert masked.count() == 4
+
+    assert voltage_to_resistance(2.5, load_resistance=10000, supply_voltage=5.0) == pytest.approx(10000)
+
+
+def test_gas_history(GPIO, smbus):
+    import numpy
+    from enviroplus import gas
+
+    history = gas.Mics6814History(3)
+    assert len(history) == 0
+    with pytest.raises(ValueError):
+        history.mean()
+
+    for i in range(5):
+        history.append(gas.Mics6814Reading(i, i * 10, i * 100, timestamp=float(i)))
+
+    assert len(history) == 3
+    assert history.timestamps.tolist() == [2.0, 3.0, 4.0]
+    assert history.column('reducing').tolist() == [20, 30, 40]
+    assert numpy.isnan(history.column('adc')).all()
+    assert not history.values.flags.writeable
+
+    reading = history[-1]
+    assert (reading.oxidising, reading.nh3, reading.adc, reading.timestamp) == (4, 400, None, 4.0)
+    assert [r.oxidising for r in history] == [2, 3, 4]
+    with pytest.raises(IndexError):
+        history[3]
+
+    mean = history.mean()
+    assert (mean.oxidising, mean.reducing, mean.adc) == (3, 30, None)
+    assert history.max().nh3 == 400
+
+    window = history.window(3.0, 4.0)
+    assert len(window) == 1 and window[0].oxidising == 3
+
+    history.extend([5.0, 6.0], [[5, 50, 500, 0.5], [6, 60, 600, 0.6]])
+    assert history.timestamps.tolist() == [4.0, 5.0, 6.0]
+    assert history.min().adc == 0.5
+
+    copy = gas.Mics6814History.from_readings(history)
+    assert copy.size == 3
+    numpy.testing.assert_array_equal(copy.values, history.values)
+    numpy.testing.assert_array_equal(copy.timestamps, history.timestamps)
+
+
+def test_gas_baseline_ewma(GPIO, smbus, tmp_path):
+    import json
+    from enviroplus import gas
+
+    path = str(tmp_path / 'baseline.json')
+    baseline = gas.Mics6814Baseline(time_constant=10.0, path=path, save_interval=0)
+    assert baseline.baseline() is None
+
+    baseline.update(gas.Mics6814Reading(20000, 400000, 800000, timestamp=0.0))
+    for t in range(1, 200):
+        baseline.update(gas.Mics6814Reading(30000, 200000, 400000, timestamp=float(t)))
+
+    r0 = baseline.baseline()
+    assert r0.oxidising == pytest.approx(30000, rel=1e-3)
+    assert r0.reducing == pytest.approx(200000, rel=1e-3)
+
+    ratios = baseline.ratios(gas.Mics6814Reading(60000, 100000, 400000))
+    assert ratios.oxidising == pytest.approx(2.0, rel=1e-3)
+    assert ratios.reducing == pytest.approx(0.5, rel=1e-3)
+
+    restored = gas.Mics6814Baseline(time_constant=10.0, path=path)
+    assert restored.samples == 200
+    assert restored.baseline().nh3 == pytest.approx(r0.nh3)
+
+    with pytest.raises(ValueError):
+        gas.Mics6814Baseline(method='percentile', path=path)
+
+    with pytest.raises(ValueError):
+        gas.Mics6814Baseline().save()
+
+    with open(path) as f:
+        state = json.load(f)
+    state['histograms'] = [[0.0] * 10] * 3
+    with open(path, 'w') as f:
+        json.dump(state, f)
+    with pytest.raises(ValueError):
+        gas.Mics6814Baseline(time_constant=10.0, path=path)
+
+
+def test_gas_baseline_percentile(GPIO, smbus):
+    from enviroplus import gas
+
+    baseline = gas.Mics6814Baseline(method='percentile', time_constant=1e6)
+    for t in range(100):
+        # Clean air most of the time, with occasional pollution events
+        polluted = t % 10 == 0
+        baseline.update(gas.Mics6814Reading(
+            90000 if polluted else 30000,
+            20000 if polluted else 200000,
+            50000 if polluted else 500000,
+            timestamp=float(t)))
+
+    r0 = baseline.baseline()
+    assert r0.oxidising == pytest.approx(30000, rel=0.06)
+    assert r0.reducing == pytest.approx(200000, rel=0.06)
+    assert r0.nh3 == pytest.approx(500000, rel=0.06)
+
+
+def test_gas_ratio_to_ppm(GPIO, smbus):
+    import numpy
+    from enviroplus import gas
+
+    assert gas.ratio_to_ppm('co', 0.0705) == pytest.approx(100, rel=1e-6)
+    assert gas.ratio_to_ppm('no2', 6.76) == pytest.approx(1, rel=1e-6)
+
+    ppm = gas.ratio_to_ppm('nh3', numpy.array([0.2, 0.1, 2.0]))
+    assert ppm[0] == pytest.approx(10, rel=1e-6)
+    assert 30 < ppm[1] < 100
+    assert numpy.isnan(ppm[2])
+
+    with pytest.raises(ValueError):
+        gas.ratio_to_ppm('ozone', 1.0)
+
+    baseline = gas.Mics6814Baseline()
+    baseline.update(gas.Mics6814Reading(10000, 100000, 100000))
+    estimate = baseline.ppm(gas.Mics6814Reading(67600, 7050, 20000))
+    assert estimate['no2'] == pytest.approx(1, rel=1e-3)
+    assert estimate['co'] == pytest.approx(100, rel=1e-3)
+    assert estimate['nh3'] == pytest.approx(10, rel=1e-3)
+
+
+def test_gas_compensation(GPIO, smbus):
+    import numpy
+    from enviroplus import gas
+
+    # Resistances falling 2% per degree and 1% per %RH from their values at 20C, 50%RH
+    temperatures = numpy.array([10.0, 15.0, 20.0, 25.0, 30.0, 20.0])
+    humidities = numpy.array([50.0, 30.0, 60.0, 40.0, 70.0, 50.0])
+    r_ref = numpy.array([20000.0, 200000.0, 500000.0])
+    factor = numpy.exp(-0.02 * (temperatures - 20) - 0.01 * (humidities - 50))
+    resistances = r_ref * factor[:, None]
+
+    compensation = gas.Mics6814Compensation()
+    coefficients = compensation.fit(temperatures, humidities, resistances)
+    assert coefficients[0] == pytest.approx((-0.02, -0.01))
+
+    numpy.testing.assert_allclose(compensation.compensate(temperatures, humidities, resistances), numpy.tile(r_ref, (6, 1)))
+
+    reading = gas.Mics6814Reading(*resistances[4], timestamp=1.0)
+    compensated = compensation.apply(reading, 30.0, 70.0)
+    assert compensated.reducing == pytest.approx(200000)
+    assert compensated.timestamp == 1.0
+
+    history = gas.Mics6814History(6)
+    history.extend(numpy.arange(6.0), resistances)
+    refit = gas.Mics6814Compensation().fit_history(history, numpy.arange(6.0), temperatures, humidities)
+    assert refit[2] == pytest.approx((-0.02, -0.01))
+
+    with pytest.raises(RuntimeError):
+        gas.Mics6814Compensation().apply(reading, 20.0, 50.0)
+
+    sensor = gas.MICS6814()
+    with pytest.raises(ValueError):
+        sensor.set_compensation(gas.Mics6814Compensation(), lambda: (20.0, 50.0))
+
+    sensor.set_compensation(gas.Mics6814Compensation(coefficients=coefficients), lambda: (20.0, 50.0))
+    result = sensor.read_all()
+    assert result.compensated.oxidising == pytest.approx(result.oxidising)
+
+
+def test_gas_warmup(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814(warmup=0.1)
+    assert sensor.heater_state() == 'off'
+    assert sensor.warmup_remaining() is None
+
+    assert sensor.read_all().status == 'warming'
+    assert sensor.heater_state() == 'warming'
+    assert 0 < sensor.warmup_remaining() <= 0.1
+
+    called = []
+    sensor.on_ready(called.append)
+    assert sensor.ready_future().result(timeout=5) is sensor
+    assert called == [sensor]
+
+    assert sensor.heater_state() == 'valid'
+    assert sensor.warmup_remaining() == 0
+    assert sensor.read_all().status == 'valid'
+
+    sensor.on_ready(called.append)
+    assert len(called) == 2
+
+    sensor.cleanup()
+    assert sensor.heater_state() == 'off'
+    assert sensor.read_all().status == 'off'
+    assert sensor.heater_state() == 'off'
+
+    # setup switches the heater back on and restarts the warm-up
+    sensor.setup()
+    GPIO.output.assert_called_with(gas.MICS6814_HEATER_PIN, 1)
+    assert sensor.heater_state() == 'warming'
+    assert sensor.ready_future().result(timeout=5) is sensor
+    assert sensor.read_all().status == 'valid'
+
+
+def test_gas_warmup_no_heater_pin(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814(heater_pin=None, warmup=0)
+    assert sensor.read_all().status == 'valid'
+    assert sensor.heater_state() == 'valid'
+
+
+def test_gas_compensation_environment_error(GPIO, smbus):
+    import time
+    from enviroplus import gas
+
+    def environment():
+        raise IOError("BME280 read failed")
+
+    sensor = gas.MICS6814()
+    sensor.set_compensation(gas.Mics6814Compensation(coefficients=((0, 0), (0, 0), (0, 0))), environment)
+
+    result = sensor.read_all()
+    assert int(result.oxidising) == 16641
+    assert result.compensated is None
+
+    sensor.start_sampler(interval=0.01, history=3)
+    t_start = time.time()
+    while len(sensor.history) < 3 and time.time() - t_start < 5:
+        time.sleep(0.01)
+
+    assert sensor._sampler.is_alive()
+    assert sensor.get_latest().compensated is None
+    sensor.stop_sampler()
+
+
+def test_gas_warmup_not_connected(GPIO, mocksmbus):
+    from enviroplus import gas
+    mocksmbus.SMBus(1).read_i2c_block_data.side_effect = IOError("Oh noes!")
+
+    sensor = gas.MICS6814()
+    with pytest.raises(RuntimeError):
+        sensor.on_ready(lambda sensor: None)
+
+    with pytest.raises(RuntimeError):
+        sensor.ready_future().result(timeout=1)
+    assert sensor.heater_state() == 'off'
+
+
+def test_gas_warmup_after_cleanup(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814(warmup=60)
+    sensor.setup()
+    sensor.cleanup()
+    with pytest.raises(RuntimeError):
+        sensor.ready_future().result(timeout=1)
+
+
+def test_gas_continuous_mode_same_channel(GPIO, smbus):
+    from enviroplus import gas
+
+    sensor = gas.MICS6814(mode='continuous', sample_rate=3300)
+    sensor.setup()
+    period = gas.MICS6814_CLOCK_MARGIN / 3300
+
+    with mock.patch.object(sensor.adc, 'set_multiplexer', wraps=sensor.adc.set_multiplexer) as set_multiplexer, \
+            mock.patch('time.sleep') as sleep:
+        for _ in range(3):
+            assert int(sensor.read_oxidising()) == 16641
+        assert set_multiplexer.call_count == 1
+        # Only the input switch waits out the conversion in progress
+        assert sleep.call_args_list[0] == mock.call(period * 2)
+        assert all(call[0][0] <= period for call in sleep.call_args_list[1:])
+
+        # Oxidising is still selected, each later channel change waits two conversion periods
+        sleep.reset_mock()
+        sensor.read_all()
+        assert set_multiplexer.call_count == 3
+        assert sleep.call_args_list.count(mock.call(period * 2)) == 2